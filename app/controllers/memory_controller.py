@@ -1,20 +1,258 @@
 from langchain.vectorstores import Chroma
 from langchain.embeddings import OpenAIEmbeddings
-from typing import Optional
+from langchain.embeddings.base import Embeddings
+from cachetools import LRUCache
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import os
+import threading
+import numpy as np
 import tiktoken
 
+from services.batching import drain
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+ADD_BATCH_MAX = int(os.getenv("MEMORY_ADD_BATCH_MAX", "32"))
+ADD_BATCH_WINDOW = float(os.getenv("MEMORY_ADD_BATCH_WINDOW_MS", "50")) / 1000
+ADD_QUEUE_MAX = int(os.getenv("MEMORY_ADD_QUEUE_MAX", "10000"))
+QUERY_BATCH_MAX = int(os.getenv("MEMORY_QUERY_BATCH_MAX", "32"))
+QUERY_BATCH_WINDOW = float(os.getenv("MEMORY_QUERY_BATCH_WINDOW_MS", "5")) / 1000
+# Opt-in: the index only sees this controller's writes, and a miss skips the search entirely.
+# Enable only when this process is the store's sole writer (one worker, no external loaders).
+USE_METADATA_INDEX = os.getenv("MEMORY_METADATA_INDEX", "0") == "1"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()   # openai|fastembed
+FASTEMBED_MODEL = os.getenv("FASTEMBED_MODEL", "BAAI/bge-small-en-v1.5")
+# BPE tables load once per process, not per controller (cl100k_base == ada-002's encoding)
+_ENC = tiktoken.get_encoding("cl100k_base")
+
+# Vectors are stored unit-length, so inner product == cosine; "ip" only applies
+# to newly created collections (an existing store keeps the space it was built with).
+HNSW_SPACE = os.getenv("CHROMA_HNSW_SPACE", "ip")
+INDEX_FIELDS = ("entity_id", "platform", "thread_id")
+
+# text -> vector, shared by every controller in the process
+# (filled from to_thread workers; cachetools isn't thread-safe → cache + counters under one lock)
+_embedding_cache: "LRUCache[str, List[float]]" = LRUCache(maxsize=EMBED_CACHE_SIZE)
+_cache_lock = threading.Lock()
+_cache_hits = 0
+_cache_misses = 0
+
+def embedding_cache_stats() -> Dict[str, int]:
+    with _cache_lock:
+        return {"size": len(_embedding_cache), "hits": _cache_hits, "misses": _cache_misses}
+
+def _unit(vectors: List[List[float]]) -> List[List[float]]:
+    m = np.asarray(vectors, dtype=np.float32)
+    n = np.linalg.norm(m, axis=1, keepdims=True)
+    n[n == 0] = 1.0
+    return (m / n).tolist()
+
+def _log_direct_write(task: asyncio.Task):
+    # nobody awaits an enqueue_text overflow write: surface its failure here
+    if not task.cancelled() and task.exception() is not None:
+        print("🔴 ERROR in enqueue_text direct write:", task.exception())
+
+class CachedEmbeddings(Embeddings):
+    """Serve repeated texts from an in-process LRU; only misses go to the wrapped embedder.
+    Vectors are L2-normalized once here, before they are cached or stored."""
+
+    def __init__(self, inner: Embeddings):
+        self.inner = inner
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        global _cache_hits, _cache_misses
+        with _cache_lock:
+            out: List[Optional[List[float]]] = [_embedding_cache.get(t) for t in texts]
+            todo = [i for i, v in enumerate(out) if v is None]
+            _cache_hits += len(texts) - len(todo)
+            _cache_misses += len(todo)
+        if todo:
+            # one upstream call for all misses, de-duplicated (outside the lock)
+            uniq = list(dict.fromkeys(texts[i] for i in todo))
+            fresh = dict(zip(uniq, _unit(self.inner.embed_documents(uniq))))
+            with _cache_lock:
+                _embedding_cache.update(fresh)
+            for i in todo:
+                out[i] = fresh[texts[i]]
+        return out  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        global _cache_hits, _cache_misses
+        with _cache_lock:
+            v = _embedding_cache.get(text)
+            if v is not None:
+                _cache_hits += 1
+                return v
+            _cache_misses += 1
+        v = _unit([self.inner.embed_query(text)])[0]
+        with _cache_lock:
+            _embedding_cache[text] = v
+        return v
+
+def _base_embeddings() -> Embeddings:
+    if EMBEDDING_BACKEND == "fastembed":
+        # local ONNX model (pip install fastembed); no network hop per embed
+        from langchain.embeddings import FastEmbedEmbeddings
+        return FastEmbedEmbeddings(model_name=FASTEMBED_MODEL)
+    return OpenAIEmbeddings()
+
 class MemoryController:
+    tokenizer = _ENC
+
     def __init__(self):
-        self.persist_directory = "./chroma_store"
-        self.embedding = OpenAIEmbeddings()
+        # vectors from different models can't share a collection → separate store per backend
+        self.persist_directory = "./chroma_store" if EMBEDDING_BACKEND == "openai" else f"./chroma_store_{EMBEDDING_BACKEND}"
+        self.embedding = CachedEmbeddings(_base_embeddings())
         self.vectorstore = Chroma(
             persist_directory=self.persist_directory,
-            embedding_function=self.embedding
+            embedding_function=self.embedding,
+            collection_metadata={"hnsw:space": HNSW_SPACE},
         )
-        self.tokenizer = tiktoken.encoding_for_model("text-embedding-ada-002")
+        # micro-batcher for add_text (started lazily on the running loop)
+        self._add_queue: Optional["asyncio.Queue[Tuple[str, Optional[dict], asyncio.Future]]"] = None
+        self._add_worker: Optional[asyncio.Task] = None
+        self._bg_tasks: Set[asyncio.Task] = set()   # strong refs: enqueue_text overflow writes, in-flight query groups
+        # micro-batcher for ANN searches: concurrent (k, where) lookups share one collection.query
+        self._query_queue: Optional["asyncio.Queue[Tuple[List[float], int, dict, asyncio.Future]]"] = None
+        self._query_worker: Optional[asyncio.Task] = None
+        # field -> value -> doc ids; lets us skip filtered ANN calls that can't match
+        # (see USE_METADATA_INDEX for when that's safe).
+        self._index: Dict[str, Dict[str, Set[str]]] = {f: {} for f in INDEX_FIELDS}
+        self._index_state = "cold" if USE_METADATA_INDEX else "off"   # cold|ready|off
+        self._index_lock = asyncio.Lock()
+
+    # Chroma + OpenAI embedding calls are blocking; run them off the event loop.
+    async def add_texts_bulk(self, texts: List[str], metadatas: Optional[List[Optional[dict]]] = None) -> List[str]:
+        """One embedding request + one Chroma add for the whole batch."""
+        if not texts:
+            return []
+        metas = metadatas if metadatas and any(metadatas) else None
+        ids = await asyncio.to_thread(self.vectorstore.add_texts, texts, metadatas=metas)
+        if metas:
+            self._index_add(ids, metas)
+        return ids
+
+    async def add_text(self, text: str, metadata: Optional[dict] = None) -> str:
+        """Queue a single text; concurrent callers are coalesced into one add_texts_bulk."""
+        self._ensure_add_worker()
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._add_queue.put((text, metadata, fut))
+        return await fut
+
+    def enqueue_text(self, text: str, metadata: Optional[dict] = None) -> str:
+        """Fire-and-forget add_text for request paths that don't need the doc id.
+        Returns "queued", or "direct" when the queue is full and the write runs as its own task."""
+        self._ensure_add_worker()
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())   # _add_loop already logs failures
+        try:
+            self._add_queue.put_nowait((text, metadata, fut))
+            return "queued"
+        except asyncio.QueueFull:
+            task = asyncio.create_task(self.add_texts_bulk([text], [metadata]))
+            self._bg_tasks.add(task)
+            task.add_done_callback(self._bg_tasks.discard)
+            task.add_done_callback(_log_direct_write)
+            return "direct"
+
+    def _ensure_add_worker(self):
+        if self._add_worker is None or self._add_worker.done():
+            self._add_queue = asyncio.Queue(maxsize=ADD_QUEUE_MAX)
+            self._add_worker = asyncio.create_task(self._add_loop(self._add_queue))
+
+    async def _add_loop(self, queue: "asyncio.Queue[Tuple[str, Optional[dict], asyncio.Future]]"):
+        while True:
+            batch = await drain(queue, ADD_BATCH_MAX, ADD_BATCH_WINDOW)
+            try:
+                ids = await self.add_texts_bulk([b[0] for b in batch], [b[1] for b in batch])
+            except Exception as e:
+                print("🔴 ERROR in add_text batch:", e)
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, _, fut), doc_id in zip(batch, ids):
+                if not fut.done():
+                    fut.set_result(doc_id)
 
-    def add_text(self, text: str, metadata: Optional[dict] = None):
-        self.vectorstore.add_texts([text], metadatas=[metadata] if metadata else None)
+    async def _search(self, vec: List[float], k: int, where: dict) -> List[Dict[str, Any]]:
+        """Queue one ANN lookup; searches arriving within the window are sent as one multi-vector query."""
+        if self._query_worker is None or self._query_worker.done():
+            self._query_queue = asyncio.Queue()
+            self._query_worker = asyncio.create_task(self._query_loop(self._query_queue))
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        await self._query_queue.put((vec, k, where, fut))
+        return await fut
+
+    async def _query_loop(self, queue: "asyncio.Queue[Tuple[List[float], int, dict, asyncio.Future]]"):
+        while True:
+            batch = await drain(queue, QUERY_BATCH_MAX, QUERY_BATCH_WINDOW)
+            # collection.query takes one where/n_results per call → group by them
+            groups: Dict[Tuple[int, str], list] = {}
+            for item in batch:
+                groups.setdefault((item[1], json.dumps(item[2], sort_keys=True)), []).append(item)
+            # don't wait for the queries: searches arriving meanwhile form the next batch right away
+            for items in groups.values():
+                task = asyncio.create_task(self._query_group(items))
+                self._bg_tasks.add(task)
+                task.add_done_callback(self._bg_tasks.discard)
+
+    async def _query_group(self, items: list):
+        _, k, where, _ = items[0]
+        try:
+            res = await asyncio.to_thread(
+                self.vectorstore._collection.query,
+                query_embeddings=[i[0] for i in items], n_results=k, where=where,
+                include=["documents", "metadatas", "distances"],
+            )
+            for n, (*_, fut) in enumerate(items):
+                if not fut.done():
+                    fut.set_result([
+                        {"text": doc, "metadata": md or {}, "score": dist}
+                        for doc, md, dist in zip(res["documents"][n], res["metadatas"][n], res["distances"][n])
+                    ])
+        except Exception as e:   # runs as a detached task: every waiter must get an outcome
+            print("🔴 ERROR in query batch:", e)
+            for *_, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    def _index_add(self, ids: List[str], metadatas: List[Optional[dict]]):
+        for doc_id, md in zip(ids, metadatas):
+            if not md:
+                continue
+            for f in INDEX_FIELDS:
+                v = md.get(f)
+                if v is not None:
+                    self._index[f].setdefault(str(v), set()).add(doc_id)
+
+    async def _index_ready(self) -> bool:
+        if self._index_state == "cold":
+            async with self._index_lock:
+                if self._index_state == "cold":
+                    try:
+                        got = await asyncio.to_thread(self.vectorstore._collection.get, include=["metadatas"])
+                        self._index_add(got["ids"], got["metadatas"] or [])
+                        self._index_state = "ready"
+                    except Exception as e:
+                        print("🔴 ERROR priming metadata index:", e)
+                        self._index_state = "off"
+        return self._index_state == "ready"
+
+    def _candidates(self, entity_id, platform=None, thread_id=None) -> Set[str]:
+        sets = [self._index["entity_id"].get(str(entity_id), set())]
+        if platform:
+            sets.append(self._index["platform"].get(str(platform), set()))
+        if thread_id:
+            sets.append(self._index["thread_id"].get(str(thread_id), set()))
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    async def _has_candidates(self, entity_id, platform=None, thread_id=None) -> bool:
+        if not await self._index_ready():
+            return True   # no index → let Chroma decide
+        return bool(self._candidates(entity_id, platform, thread_id))
 
     def build_filter(self, entity_id, platform=None, thread_id=None):
         clauses = [{"entity_id": entity_id}]
@@ -24,35 +262,44 @@ class MemoryController:
             clauses.append({"thread_id": thread_id})
         return {"$and": clauses} if len(clauses) > 1 else clauses[0]
 
-    def query_text(self, query: str, entity_id: str, platform: Optional[str] = None, thread_id: Optional[str] = None, top_k: int = 5):
+    async def query_text(self, query: str, entity_id: str, platform: Optional[str] = None, thread_id: Optional[str] = None, top_k: int = 5):
         try:
-            filters = self.build_filter(entity_id, platform, thread_id)
-            results = self.vectorstore.similarity_search_with_score(query, k=top_k, filter=filters)
-            if results:
-                print("✅ Matched with strict filter.")
-                return [
-                    {"text": r[0].page_content, "metadata": r[0].metadata, "score": r[1]}
-                    for r in results
-                ]
-
-            print("⚠️ No strict match — falling back to entity_id only.")
-            fallback_results = self.vectorstore.similarity_search_with_score(query, k=top_k, filter={"entity_id": entity_id})
-            return [
-                {"text": r[0].page_content, "metadata": r[0].metadata, "score": r[1]}
-                for r in fallback_results
-            ]
+            if not await self._has_candidates(entity_id):
+                return []
+            strict = self.build_filter(entity_id, platform, thread_id)
+            loose = {"entity_id": entity_id}
+            # embed once, then run strict + fallback searches concurrently
+            vec = await asyncio.to_thread(self.embedding.embed_query, query)
+
+            if strict != loose and await self._has_candidates(entity_id, platform, thread_id):
+                results, fallback_results = await asyncio.gather(
+                    self._search(vec, top_k, strict),
+                    self._search(vec, top_k, loose),
+                )
+                if results:
+                    print("✅ Matched with strict filter.")
+                    return results
+                print("⚠️ No strict match — falling back to entity_id only.")
+            else:
+                fallback_results = await self._search(vec, top_k, loose)
+            return fallback_results
         except Exception as e:
             print("🔴 ERROR in query_text:", e)
             return []
 
-    def retrieve_all_for_entity(self, entity_id: str, platform: Optional[str] = None, thread_id: Optional[str] = None):
+    async def retrieve_all_for_entity(self, entity_id: str, platform: Optional[str] = None, thread_id: Optional[str] = None):
         try:
+            if not await self._has_candidates(entity_id, platform, thread_id):
+                return []
             filters = self.build_filter(entity_id, platform, thread_id)
-            results = self.vectorstore.similarity_search_with_score("", k=100, filter=filters)
+            # plain metadata scan: no query embedding, no ANN traversal
+            got = await asyncio.to_thread(
+                self.vectorstore._collection.get, where=filters, limit=100, include=["documents", "metadatas"]
+            )
             return [
-                {"text": r[0].page_content, "metadata": r[0].metadata, "score": r[1]}
-                for r in results
+                {"text": doc, "metadata": md or {}, "score": 0.0}
+                for doc, md in zip(got["documents"] or [], got["metadatas"] or [])
             ]
         except Exception as e:
             print("🔴 ERROR in retrieve_all_for_entity:", e)
-            return []
\ No newline at end of file
+            return []
@@ -1,19 +1,42 @@
 # memory_server.py
-import sys, os, json, asyncio, logging
+import sys, os, asyncio, logging, queue
+from logging.handlers import QueueHandler, QueueListener
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers.memory_router import router as memory_router
 from routers.gpt_router import router as gpt_router
-from routers.chat_router import router as chat_router
+from routers.chat_router import router as chat_router, flush_ingest_queue, USE_LLM_REWRITE
 from routers.debug_router import router as debug_router
-from services.chat_instructions_loader import warm_prompts
+from services.chat_instructions_loader import warm_prompts, close_http as close_prompt_http
+from services.openai_client import close_client
+from services.logfmt import j
 
 # ---- Logging: JSON lines (Render-friendly) ----
+# While the app runs (startup → shutdown), handlers on the event loop only enqueue and a
+# listener thread does the stdout writes. Outside that window (imports, scripts, tests that
+# never start the app) records go straight to stdout, so nothing piles up in the queue.
+_log_out = logging.StreamHandler(sys.stdout)
+_log_out.setFormatter(logging.Formatter("%(message)s"))
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_enqueue = QueueHandler(_log_queue)   # formats before enqueueing ("%(message)s")
+_log_listener = QueueListener(_log_queue, _log_out)
 logging.basicConfig(
-    stream=sys.stdout,
     level=os.getenv("LOG_LEVEL", "INFO").upper(),
-    format="%(message)s",
+    handlers=[_log_out],
 )
+
+def _start_log_queue():
+    root = logging.getLogger()
+    _log_listener.start()
+    root.addHandler(_log_enqueue)
+    root.removeHandler(_log_out)
+
+def _stop_log_queue():
+    root = logging.getLogger()
+    root.addHandler(_log_out)
+    root.removeHandler(_log_enqueue)
+    _log_listener.stop()   # flushes what's still queued
+
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 
 app = FastAPI()
@@ -40,26 +63,49 @@ def health():
     return {"ok": True}
 
 # ---- Prompt warmup (non-blocking + timeboxed) ----
-PROMPT_STARTUP_WARM = os.getenv("PROMPT_STARTUP_WARM", "0") == "1"
+# on by default when turns use the policy prompt, so the first turns don't each wait on a fetch
+PROMPT_STARTUP_WARM = os.getenv("PROMPT_STARTUP_WARM", "1" if USE_LLM_REWRITE else "0") == "1"
 PROMPT_WARM_LABELS = os.getenv(
     "PROMPT_WARM_LABELS", "hiring,automation,staffing,general"
 ).split(",")
 PROMPT_WARM_TIMEOUT = float(os.getenv("PROMPT_WARM_TIMEOUT", "2.5"))
+# re-warm before PROMPT_CACHE_TTL runs out, so turns read prompts from cache and never
+# wait on the prompt store (0 = warm once at startup only)
+PROMPT_REFRESH_SECS = float(os.getenv("PROMPT_REFRESH_SECS", "600"))
+_prompt_task = None
+
+async def _warm_once():
+    try:
+        versions = await asyncio.wait_for(
+            warm_prompts(PROMPT_WARM_LABELS), timeout=PROMPT_WARM_TIMEOUT
+        )
+        logging.info(j({"event": "prompts.warm", "versions": versions}))
+    except asyncio.TimeoutError:
+        logging.info(j({"event": "prompts.warm.timeout"}))
+    except Exception as e:
+        logging.info(j({"event": "prompts.warm.error", "error": str(e)}))
+
+async def _warm_loop():
+    await _warm_once()
+    while PROMPT_REFRESH_SECS > 0:
+        await asyncio.sleep(PROMPT_REFRESH_SECS)
+        await _warm_once()
 
 @app.on_event("startup")
 async def startup():
+    global _prompt_task
+    _start_log_queue()
     if PROMPT_STARTUP_WARM:
-        async def _bg():
-            try:
-                versions = await asyncio.wait_for(
-                    warm_prompts(PROMPT_WARM_LABELS), timeout=PROMPT_WARM_TIMEOUT
-                )
-                logging.info(json.dumps({"event": "prompts.warm", "versions": versions}))
-            except asyncio.TimeoutError:
-                logging.info(json.dumps({"event": "prompts.warm.timeout"}))
-            except Exception as e:
-                logging.info(json.dumps({"event": "prompts.warm.error", "error": str(e)}))
-        asyncio.create_task(_bg())
+        _prompt_task = asyncio.create_task(_warm_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _prompt_task:
+        _prompt_task.cancel()
+    await flush_ingest_queue()
+    await close_client()
+    await close_prompt_http()
+    _stop_log_queue()
 
 @app.get("/")
 def root():
@@ -1,34 +1,76 @@
 # routers/chat_router.py
 from __future__ import annotations
-import os, asyncio, uuid, json, logging
-from typing import Dict, Any, List, Optional
-from fastapi import APIRouter, Header, HTTPException
+import os, asyncio, logging, threading, secrets, itertools, weakref
+from copy import deepcopy
+import orjson
+import xxhash
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from fastapi import APIRouter, Header, HTTPException, Response
 from pydantic import BaseModel, Field
+from cachetools import LRUCache, TTLCache
 
-from routers.memory_router import ensure_conversation, ingest_message
+from routers.memory_router import ensure_conversation, ingest_messages, ingest_messages_bulk
 from services.slot_extraction import extract_slots_from_turn
-from services.stage_machine import missing_for_stage, next_stage, advance_until_stable
+from services.stage_machine import compute_plan
 from services.slot_extraction import smart_merge_slots
 from services.ask_builder import build_reply
+from services.logfmt import j as _j
+from services.batching import drain
 from services.rewriter import rewrite
-from services.chat_instructions_loader import get_prompt_for
-from services.extract_multi import extract_jobs
+from routers.gpt_router import run_llm_turn
+from services.openai_client import OPENAI_MAX_INFLIGHT
+from services.chat_instructions_loader import get_prompt_for, get_cached_prompt
+from services.extract_multi import extract_jobs, might_have_multiple_jobs
 from services.request_scope import (
     ensure_active_request, begin_request, update_request,
-    get_active_rid, set_active_rid, get_request, list_requests_for_thread
+    set_active_rid, get_request, list_requests_for_thread,
+    thread_version, thread_request_count,
 )
 
-# Optional: recover prior slots from history if client didn't send any
+# Optional: recover a request's slots from history when its request state is gone
 try:
-    from services.memory_store import list_recent  # your own helper; adjust import if needed
+    from services.memory_store import request_slots  # your own helper; adjust import if needed
 except Exception:
-    def list_recent(_: str, limit: int = 12) -> List[Dict[str, Any]]:
-        return []
+    def request_slots(_: str, rid: str) -> Optional[Dict[str, Any]]:
+        return None
 
 LLM_TIMEOUT_SECS = int(os.getenv("LLM_TIMEOUT_SECS", "18"))
-USE_LLM_REWRITE  = os.getenv("USE_LLM_REWRITE", "0") == "1"
+# reply written by gpt_router.run_llm_turn (state + conversation CONTEXT) instead of the deterministic text;
+# it already phrases the reply, so it replaces the tone rewrite
+USE_LLM_TURN     = os.getenv("USE_LLM_TURN", "0") == "1"
+USE_LLM_REWRITE  = os.getenv("USE_LLM_REWRITE", "0") == "1" and not USE_LLM_TURN
+# at most this many rewrites in flight per worker; once this many more are queued, shed to the deterministic text
+# (default: half the process-wide LLM slots, so rewrites can't starve the other endpoints)
+LLM_REWRITE_CONCURRENCY = int(os.getenv("LLM_REWRITE_CONCURRENCY", str(max(1, OPENAI_MAX_INFLIGHT // 2))))
+LLM_REWRITE_QUEUE_MAX   = int(os.getenv("LLM_REWRITE_QUEUE_MAX", "64"))
+# threads with fewer requests than this get the list inline; larger ones only the version
+REQUESTS_INLINE_MAX = int(os.getenv("CHAT_REQUESTS_INLINE_MAX", "8"))
+# turn rows are written in batches across turns: up to BATCH_MAX turns or WINDOW_MS, whichever first
+INGEST_BATCH_MAX = int(os.getenv("CHAT_INGEST_BATCH_MAX", "64"))
+INGEST_WINDOW = float(os.getenv("CHAT_INGEST_WINDOW_MS", "200")) / 1000
+INGEST_QUEUE_MAX = int(os.getenv("CHAT_INGEST_QUEUE_MAX", "10000"))
+INGEST_SHUTDOWN_TIMEOUT = float(os.getenv("CHAT_INGEST_SHUTDOWN_TIMEOUT_S", "10"))
 
 router = APIRouter(prefix="/chat")
+log = logging.getLogger(__name__)
+
+# Breadcrumb "slots_mask": bit i set ⇔ merged[_SLOT_KEYS[i]] is filled
+# (1=role_title 2=location 4=budget 8=seniority 16=stack; 31 = all present)
+_SLOT_KEYS = ("role_title", "location", "budget", "seniority", "stack")
+
+# Fallback idempotency keys: random per-process prefix + counter (no urandom read per turn).
+# Only used as dedup keys for this turn's rows, so process-local uniqueness is enough.
+_IDEM_PREFIX = secrets.token_hex(8)
+_IDEM_COUNTER = itertools.count()
+
+# strong refs to in-flight background writes (the loop only keeps weak ones)
+BACKGROUND_TASKS: "set[asyncio.Task]" = set()
+
+# (cid, rid) -> latest slots written by this process (saves a store lookup per turn).
+# cachetools caches aren't thread-safe and to_thread workers share them → guard with a lock.
+_SLOT_CACHE: "TTLCache[Tuple[str, str], Dict[str, Any]]" = TTLCache(maxsize=10_000, ttl=3600)
+_SLOT_LOCK = threading.RLock()
 
 
 # ---------- Models ----------
@@ -47,21 +89,149 @@ class TurnOut(BaseModel):
     meta: Dict[str, Any] = Field(default_factory=dict)
 
 
-def last_slots_for_cid(cid: str) -> Dict[str, Any]:
-    """Scan recent messages for latest stored slots (best-effort)."""
+# Extractors are pure functions of the text; retries / resends hit these instead of
+# re-running the regex passes. Keyed by xxh3 (stable across workers, unlike hash()).
+_EXTRACT_CACHE: "LRUCache[Tuple[str, int], Any]" = LRUCache(maxsize=50_000)
+_EXTRACT_LOCK = threading.Lock()
+
+def _memo_extract(kind: str, fn, text: str):
+    key = (kind, xxhash.xxh3_64_intdigest(text.encode()))
+    with _EXTRACT_LOCK:
+        v = _EXTRACT_CACHE.get(key)
+    if v is None:
+        v = fn(text)
+        with _EXTRACT_LOCK:
+            _EXTRACT_CACHE[key] = v
+    return deepcopy(v)   # callers merge/seed from these; keep the cached copy pristine
+
+
+def remember_slots(cid: str, rid: str, slots: Dict[str, Any]) -> None:
+    with _SLOT_LOCK:
+        _SLOT_CACHE[(cid, rid)] = slots
+
+
+def last_slots_for_rid(cid: str, rid: str) -> Dict[str, Any]:
+    """Latest stored slots for one chat request (cache first, then the store)."""
+    with _SLOT_LOCK:
+        cached = _SLOT_CACHE.get((cid, rid))
+    if cached is not None:
+        return cached
     try:
-        rows = list_recent(cid, limit=12) or []
-        for r in reversed(rows):
-            meta = r.get("meta") or {}
-            if isinstance(meta, dict) and isinstance(meta.get("slots"), dict):
-                return meta["slots"]
+        return request_slots(cid, rid) or {}
     except Exception:
-        pass
-    return {}
+        return {}
+
+
+async def _persist(cid: str, rid: str, rows: List[Dict[str, Any]]) -> None:
+    """Best-effort store of a turn's rows, off the response path."""
+    try:
+        await asyncio.to_thread(ingest_messages, cid, rows)
+    except Exception as e:
+        log.warning(_j({"event":"store.turn.error","cid":cid,"rid":rid,"err":str(e)}))
+
+
+def _spawn(coro) -> asyncio.Task:
+    # its own task, not the request's: a client disconnect doesn't abort the write
+    task = asyncio.create_task(coro)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    return task
+
+
+# (cid, rid, rows) per turn; drained by _ingest_flusher (started lazily on the running loop)
+_INGEST_QUEUE: "Optional[asyncio.Queue[Tuple[str, str, List[Dict[str, Any]]]]]" = None
+_INGEST_TASK: Optional[asyncio.Task] = None
+
+async def _write_batch(batch: List[Tuple[str, str, List[Dict[str, Any]]]]) -> None:
+    try:
+        await asyncio.to_thread(ingest_messages_bulk, [(cid, rows) for cid, _, rows in batch])
+    except Exception as e:
+        log.warning(_j({"event":"store.batch.error","turns":len(batch),"rids":[rid for _, rid, _ in batch],"err":str(e)}))
+
+async def _ingest_flusher(queue: asyncio.Queue) -> None:
+    while True:
+        batch: list = []
+        try:
+            await drain(queue, INGEST_BATCH_MAX, INGEST_WINDOW, into=batch)
+        except asyncio.CancelledError:
+            if batch:
+                await _write_batch(batch)   # shutdown mid-window: rows already off the queue
+            raise
+        await _write_batch(batch)
+
+def _queue_persist(cid: str, rid: str, rows: List[Dict[str, Any]]) -> None:
+    """Hand a turn's rows to the batch writer; when it's backed up, write them on their own."""
+    global _INGEST_QUEUE, _INGEST_TASK
+    if _INGEST_QUEUE is None:
+        _INGEST_QUEUE = asyncio.Queue(maxsize=INGEST_QUEUE_MAX)
+    if _INGEST_TASK is None or _INGEST_TASK.done():
+        _INGEST_TASK = asyncio.create_task(_ingest_flusher(_INGEST_QUEUE))
+    try:
+        _INGEST_QUEUE.put_nowait((cid, rid, rows))
+    except asyncio.QueueFull:
+        _spawn(_persist(cid, rid, rows))
+
+async def flush_ingest_queue() -> None:
+    """Shutdown hook: stop the flusher, write whatever is still queued and wait (bounded)
+    for overflow writes already in flight."""
+    global _INGEST_QUEUE, _INGEST_TASK
+    queue, task = _INGEST_QUEUE, _INGEST_TASK
+    _INGEST_QUEUE = _INGEST_TASK = None   # both are bound to this loop; the next one starts fresh
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    if queue is not None and not queue.empty():
+        batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        await _write_batch(batch)
+    if BACKGROUND_TASKS:
+        _, pending = await asyncio.wait(list(BACKGROUND_TASKS), timeout=INGEST_SHUTDOWN_TIMEOUT)
+        if pending:
+            log.warning(_j({"event":"store.shutdown.pending","tasks":len(pending)}))
+
+
+_REWRITE_SEM = asyncio.Semaphore(LLM_REWRITE_CONCURRENCY)
+_rewrite_waiting = 0
+
+async def _bounded_rewrite(text: str, policy: Optional[str]) -> Optional[str]:
+    """rewrite() under the per-worker cap; None when the wait queue is full (caller keeps `text`)."""
+    global _rewrite_waiting
+    if _REWRITE_SEM.locked() and _rewrite_waiting >= LLM_REWRITE_QUEUE_MAX:
+        return None
+    _rewrite_waiting += 1
+    try:
+        await _REWRITE_SEM.acquire()
+    finally:
+        _rewrite_waiting -= 1
+    try:
+        return await rewrite(text, policy=policy)
+    finally:
+        _REWRITE_SEM.release()
+
+
+# cid -> lock; weak values, so a conversation's lock goes away once no turn holds or awaits it
+_CONV_LOCKS: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _conv_lock(cid: str) -> asyncio.Lock:
+    lock = _CONV_LOCKS.get(cid)
+    if lock is None:
+        lock = _CONV_LOCKS[cid] = asyncio.Lock()
+    return lock
+
+
+@lru_cache(maxsize=100_000)
+def _cid_for(entity_id: str, platform: str, thread_id: str) -> str:
+    """cid is stable per (entity, platform, thread); resolve it once per process."""
+    cid = ensure_conversation(entity_id, platform, thread_id)
+    if not cid:  # raising keeps the empty result out of the cache
+        raise HTTPException(500, "ensure_conversation returned empty id")
+    return cid
 
 
 # ---------- Route ----------
-@router.post("/turn", response_model=TurnOut)
+# TurnOut documents the body; the handler serializes it itself (no second validation pass)
+@router.post("/turn", response_model=None, responses={200: {"model": TurnOut}})
 async def chat_turn(
     req: TurnIn,
     entity_id: str = Header(..., alias="entity-id"),
@@ -70,98 +240,137 @@ async def chat_turn(
     user_id:   str = Header(..., alias="user-id"),
     idem_hdr: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
-    cid = ensure_conversation(entity_id, platform, thread_id)
-    if not cid:
-        raise HTTPException(500, "ensure_conversation returned empty id")
-    idem = idem_hdr or uuid.uuid4().hex
-
-    # active rid (from client meta or memory)
-    rid = (req.meta or {}).get("rid") or ensure_active_request(cid, thread_id)
-    active = get_request(rid) or {}
-    prev_slots = active.get("slots") or {}
-    stage_in   = active.get("stage") or "collect"
-
-    # Multi-job detection
-    jobs = extract_jobs(req.text)
-    spawned_rid: Optional[str] = None
-    if len(jobs) >= 2:
-        created: List[str] = []
-        for j in jobs:
-            r = begin_request(cid, thread_id, seed_slots=j["slots"])
-            created.append(r)
-        # pick richest as focus
-        def richness(rid0: str) -> int:
-            s = (get_request(rid0) or {}).get("slots") or {}
-            return sum(1 for k in ("role_title","location","budget") if s.get(k))
-        created.sort(key=richness, reverse=True)
-        focus = created[0]
-        set_active_rid(thread_id, focus)
-        rid = focus
-        active = get_request(rid) or {}
+    # req.cid is never trusted: the conversation is always the one the headers resolve to
+    cid = _cid_for(entity_id, platform, thread_id)
+    idem = idem_hdr or f"{_IDEM_PREFIX}{next(_IDEM_COUNTER):016x}"
+    # policy: fresh cache is read synchronously; otherwise the fetch overlaps with
+    # extraction + stage work below
+    policy = get_cached_prompt("hiring") if USE_LLM_REWRITE else None
+    policy_task = asyncio.create_task(get_prompt_for("hiring")) if USE_LLM_REWRITE and policy is None else None
+
+    # one turn at a time per conversation: double-taps / client retries queue behind the
+    # first instead of racing it on the active request's slots and stage
+    async with _conv_lock(cid):
+        # active rid (from client meta or memory)
+        rid = req.meta.get("rid") or ensure_active_request(cid, thread_id)   # meta is always a dict (default_factory)
+        active = get_request(rid)
+        if active is None:
+            # the client's rid has no request state (e.g. lost on restart): pick up the slots
+            # stored for that rid; an rid the store never saw starts empty like any new request
+            active = {"slots": last_slots_for_rid(cid, rid)}
         prev_slots = active.get("slots") or {}
         stage_in   = active.get("stage") or "collect"
-        spawned_rid = rid
 
-    # Single job (or continuing): extract + smart merge
-    turn_slots = extract_slots_from_turn(req.text)
-    merged = smart_merge_slots(prev_slots, turn_slots, req.text)
+        # Multi-job detection
+        jobs = _memo_extract("jobs", extract_jobs, req.text) if might_have_multiple_jobs(req.text) else []
+        spawned_rid: Optional[str] = None
+        if len(jobs) >= 2:
+            created: List[str] = []
+            for j in jobs:
+                r = begin_request(cid, thread_id, seed_slots=j["slots"])
+                created.append(r)
+            # pick richest as focus (one lookup per request, single pass; ties keep creation order)
+            slot_map = {r: (get_request(r) or {}).get("slots") or {} for r in created}
+            focus = max(created, key=lambda r: sum(1 for k in ("role_title","location","budget") if slot_map[r].get(k)))
+            set_active_rid(thread_id, focus)
+            rid = focus
+            active = get_request(rid) or {}
+            prev_slots = active.get("slots") or {}
+            stage_in   = active.get("stage") or "collect"
+            spawned_rid = rid
 
-    # Store user (best-effort)
-    try:
-        ingest_message(
-            cid, "user", req.text,
-            {"entity_id":entity_id,"platform":platform,"thread_id":thread_id,"user_id":user_id,
-             "rid": rid, "slots": merged, "stage_in": stage_in},
-            f"{idem}:u"
-        )
-    except Exception as e:
-        logging.warning(json.dumps({"event":"store.user.error","cid":cid,"rid":rid,"err":str(e)}))
+        # Single job (or continuing): extract + smart merge. Blank turns (button taps)
+        # carry no slots; slot dicts are replaced, never mutated, so prev_slots is reused as is.
+        turn_slots = _memo_extract("slots", extract_slots_from_turn, req.text) if req.text.strip() else {}
+        merged = smart_merge_slots(prev_slots, turn_slots, req.text) if turn_slots else prev_slots
 
-    # Decide stage to ask from (single hop) and stage to store (multi-hop allowed)
-    stage_next  = next_stage(stage_in, merged)
-    ask_stage   = stage_next if stage_next != stage_in else stage_in
-    stage_final = advance_until_stable(stage_in, merged)
-    missing_now = missing_for_stage(ask_stage, merged)
+        # User row is persisted together with the assistant row below (one store call per turn)
+        pending: List[Dict[str, Any]] = [{
+            "role": "user", "text": req.text, "idem": f"{idem}:u",
+            "meta": {"entity_id":entity_id,"platform":platform,"thread_id":thread_id,"user_id":user_id,
+                     "rid": rid, "slots": merged, "stage_in": stage_in},
+        }]
 
-    # Deterministic text + chips
-    text, chips = build_reply(ask_stage, missing_now, turn_slots=turn_slots, prev_slots=prev_slots)
+        # Decide stage to ask from (single hop) and stage to store (multi-hop allowed)
+        ask_stage, stage_final, missing_now = compute_plan(stage_in, merged)
 
-    # Optional: LLM rewrite (kept outside this snippet; you can call your rewriter here)
-    reply_text = text  # keep deterministic baseline
+        # Deterministic text + chips
+        text, chips = build_reply(ask_stage, missing_now, turn_slots=turn_slots, prev_slots=prev_slots)
 
-    # Persist request object
-    update_request(rid, slots=merged, stage=stage_final, title=merged.get("role_title"))
+        reply_text = text  # keep deterministic baseline
+        # Optional: model-written reply from the turn's state and the conversation's memory
+        if USE_LLM_TURN:
+            try:
+                turn = await run_llm_turn(
+                    cid=cid, user_text=req.text, entity_id=entity_id, platform=platform,
+                    thread_id=thread_id, user_id=user_id, meta={"slots": merged}, fallback=text,
+                )
+                reply_text = turn.get("text") or text
+            except Exception as e:
+                log.warning(_j({"event":"llm_turn.error","cid":cid,"rid":rid,"err":str(e) or type(e).__name__}))
 
-    # Store assistant (best-effort)
-    try:
-        ingest_message(
-            cid, "assistant", reply_text,
-            {"intent":"hiring","stage":stage_final,"rid":rid,"slots":merged,"stage_in":stage_in},
-            f"{idem}:a"
-        )
-    except Exception as e:
-        logging.warning(json.dumps({"event":"store.assistant.error","cid":cid,"rid":rid,"err":str(e)}))
-
-    # Breadcrumb (helps spot loops fast)
-    logging.info(json.dumps({
-        "event":"turn",
-        "cid":cid,"rid":rid,"stage_in":stage_in,"stage_out":stage_final,
-        "missing":missing_now,
-        "got":{k:bool(merged.get(k)) for k in ["role_title","location","budget","seniority","stack"]},
-        **({"spawned_rid": spawned_rid} if spawned_rid else {})
-    }))
-
-    return {
-        "ok": True,
-        "cid": cid,
-        "rid": rid,
-        "text": reply_text,
-        "intent": "hiring",
-        "stage": stage_final,
-        "suggestions": chips,
-        "meta": {
-            "slots": merged,
-            "requests": list_requests_for_thread(thread_id),
-            **({"spawned_rid": spawned_rid} if spawned_rid else {})
+        # Optional: LLM rewrite (tone only; deterministic text stays the fallback)
+        if USE_LLM_REWRITE:
+            if policy_task is not None:
+                try:
+                    policy = await policy_task
+                except Exception:
+                    policy = None
+            try:
+                # timeout covers queueing for a slot too
+                rewritten = await asyncio.wait_for(_bounded_rewrite(text, policy), timeout=LLM_TIMEOUT_SECS)
+                if rewritten is None:
+                    log.warning(_j({"event":"rewrite.shed","cid":cid,"rid":rid}))
+                else:
+                    reply_text = rewritten
+            except Exception as e:
+                log.warning(_j({"event":"rewrite.error","cid":cid,"rid":rid,"err":str(e) or type(e).__name__}))
+
+        # Store user + assistant (best-effort) via the batch writer;
+        # the reply doesn't wait for the write.
+        pending.append({
+            "role": "assistant", "text": reply_text, "idem": f"{idem}:a",
+            "meta": {"intent":"hiring","stage":stage_final,"rid":rid,"slots":merged,"stage_in":stage_in},
+        })
+        remember_slots(cid, rid, merged)   # next turn may arrive before the write lands
+        _queue_persist(cid, rid, pending)
+
+        # Persist request object
+        update_request(rid, slots=merged, stage=stage_final, title=merged.get("role_title"))
+
+        # Breadcrumb (helps spot loops fast); built only when INFO is actually on
+        if log.isEnabledFor(logging.INFO):
+            crumb = {
+                "event":"turn",
+                "cid":cid,"rid":rid,"stage_in":stage_in,"stage_out":stage_final,
+                "missing":missing_now,
+                "slots_mask":sum(1 << i for i, k in enumerate(_SLOT_KEYS) if merged.get(k)),
+            }
+            if spawned_rid: crumb["spawned_rid"] = spawned_rid
+            log.info(_j(crumb))
+
+        # optional keys set in place (no throwaway dicts to ** into a new one)
+        out_meta: Dict[str, Any] = {"slots": merged, "requests_version": thread_version(thread_id)}
+        if thread_request_count(thread_id) < REQUESTS_INLINE_MAX:
+            out_meta["requests"] = list_requests_for_thread(thread_id)
+        if spawned_rid:
+            out_meta["spawned_rid"] = spawned_rid
+        out = {   # exactly TurnOut's fields
+            "ok": True,
+            "cid": cid,
+            "text": reply_text,
+            "intent": "hiring",
+            "stage": stage_final,
+            "suggestions": chips,
+            "meta": out_meta,
         }
-    }
\ No newline at end of file
+        return Response(orjson.dumps(out, option=orjson.OPT_NON_STR_KEYS), media_type="application/json")
+
+
+@router.get("/requests/{thread_id}")
+def chat_requests(thread_id: str, since: Optional[int] = None):
+    """Requests for a thread; the list is omitted when the client's `since` is current."""
+    v = thread_version(thread_id)
+    if since is not None and since == v:
+        return {"ok": True, "requests_version": v, "changed": False}
+    return {"ok": True, "requests_version": v, "changed": True, "requests": list_requests_for_thread(thread_id)}
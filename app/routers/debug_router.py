@@ -1,7 +1,21 @@
+import sys
 from fastapi import APIRouter
+from typing import Dict
+
+from services.rewriter import cache_stats as rewrite_cache_stats
+
+def embedding_cache_stats() -> Dict[str, int]:
+    # Report only if the controller is already loaded; importing it here would pull
+    # langchain/chromadb/tiktoken into every worker just for this endpoint.
+    mod = sys.modules.get("controllers.memory_controller")
+    return mod.embedding_cache_stats() if mod else {}
 
 router = APIRouter()
 
 @router.get("/debug")
 def debug():
     return {"status": "OK", "message": "Debug route working"}
+
+@router.get("/debug/cache")
+def debug_cache():
+    return {"embeddings": embedding_cache_stats(), "rewrite": rewrite_cache_stats()}
@@ -1,83 +1,161 @@
 # app/routers/gpt_router.py
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
-import os, re, json, asyncio
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+import os, re, sys, asyncio, logging
+from contextlib import AsyncExitStack
+from functools import lru_cache
+import orjson
+import xxhash
+from cachetools import LRUCache, TTLCache
 
-import openai  # using your existing SDK style
+from services.openai_client import LLM_TIMEOUT_SECS, get_client, llm_slot
+from services.logfmt import j
 
 router = APIRouter()
 
 # ---------- Config ----------
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo")  # classic ChatCompletion API
-openai.api_key = OPENAI_API_KEY
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-3.5-turbo")
+
+_GENERATE_SYSTEM = "You are Talent Sourcer GPT. Help users clarify their hiring need, suggest suitable roles, and match them with talent."
+_GENERATE_SYSTEM_MSG = {"role": "system", "content": _GENERATE_SYSTEM}   # built once; only the user message varies
 
 # ---------- Public request model (kept from your file) ----------
 class GPTRequest(BaseModel):
     prompt: str
     user_id: str
 
-@router.post("/generate")
-def generate_gpt_response(request: GPTRequest):
-    try:
-        resp = openai.ChatCompletion.create(
+async def _generate_once(request: GPTRequest):
+    async with llm_slot():
+        return await get_client().chat.completions.create(
             model=OPENAI_CHAT_MODEL,
             messages=[
-                {"role": "system", "content": "You are Talent Sourcer GPT. Help users clarify their hiring need, suggest suitable roles, and match them with talent."},
+                _GENERATE_SYSTEM_MSG,
                 {"role": "user", "content": request.prompt}
             ],
-            user=request.user_id
+            user=request.user_id,
         )
-        return {"reply": resp.choices[0].message["content"]}
+
+@router.post("/generate")
+async def generate_gpt_response(request: GPTRequest):
+    # async on the shared pool: no threadpool worker parked for the length of the LLM call
+    try:
+        # deadline covers queueing for a slot too
+        resp = await asyncio.wait_for(_generate_once(request), timeout=LLM_TIMEOUT_SECS)
+        return {"reply": resp.choices[0].message.content}
+    except asyncio.TimeoutError:
+        return {"reply": "Sorry, that took too long. Please try again."}
     except Exception as e:
         return {"error": str(e)}
 
+@router.post("/generate/stream")
+async def generate_gpt_stream(request: GPTRequest):
+    """Same as /generate, streamed as SSE: `data: {"delta": ...}` events, then `data: [DONE]`."""
+    async def events() -> AsyncIterator[str]:
+        parts: List[str] = []
+        try:
+            # the slot is held for the whole stream (it occupies a connection until done), so it's
+            # entered on the stack; the deadline covers waiting for it plus getting the stream started
+            async with AsyncExitStack() as stack:
+                async def _open():
+                    await stack.enter_async_context(llm_slot())
+                    return await get_client().chat.completions.create(
+                        model=OPENAI_CHAT_MODEL,
+                        messages=[
+                            _GENERATE_SYSTEM_MSG,
+                            {"role": "user", "content": request.prompt}
+                        ],
+                        user=request.user_id,
+                        stream=True,
+                    )
+                stream = await asyncio.wait_for(_open(), timeout=LLM_TIMEOUT_SECS)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield f"data: {j({'delta': delta})}\n\n"
+        except Exception as e:
+            yield f"data: {j({'error': str(e) or type(e).__name__})}\n\n"
+        finally:
+            logging.info(j({"event": "generate.stream", "user_id": request.user_id, "chars": sum(map(len, parts))}))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # ---------- Internal helpers used by chat_router ----------
 
 # Import the recent-message accessor from your memory service, if available
 try:
-    from services.memory_store import list_recent
+    from services.memory_store import list_recent, conversation_version
 except Exception:
     def list_recent(cid: str, limit: int = 8) -> List[Dict[str, Any]]:
         return []
+    def conversation_version(cid: str) -> Optional[int]:
+        return None   # no versioning → context isn't cached
+
+# Every keyword group in one pattern, scanned once per text. The lookahead makes each match
+# zero-width, so keywords that overlap or touch are all still seen (same as substring checks);
+# no two groups' keywords can start the same way, so the first alternative that fits is the only one.
+_SIGNALS_RE = re.compile(
+    r"(?=(?P<auto>automation|zapier|workflow|integrate|make\.com)"
+    r"|(?P<staff>staffing|contractor|augment)"
+    r"|(?P<loc>remote|onsite|hybrid|ahmedabad|mumbai|delhi|india|pune|bangalore)"
+    r"|(?P<money>₹|\$|lpa|budget|ctc|per month|per hour|salary)"
+    r"|(?P<otp>verify|otp)"
+    r"|(?P<verified>verified)"
+    r"|(?P<code>\b\d{6}\b)"
+    r"|(?P<match>shortlist|match|recommend)"
+    r"|(?P<sched>schedule|interview))",
+    re.I,
+)
 
-def _infer_intent(user_text: str, meta: Dict[str, Any]) -> str:
-    t = (user_text or "").lower()
-    if any(k in t for k in ["automation","zapier","workflow","integrate","make.com"]): return "automation"
-    if any(k in t for k in ["staffing","contractor","augment"]): return "staffing"
+def _signals(user_text: str) -> "set[str]":
+    """Names of the keyword groups present in the text."""
+    return {m.lastgroup for m in _SIGNALS_RE.finditer(user_text or "")}
+
+def _infer_intent(user_text: str, meta: Dict[str, Any], sig: "Optional[set[str]]" = None) -> str:
+    f = _signals(user_text) if sig is None else sig
+    if "auto" in f: return "automation"
+    if "staff" in f: return "staffing"
     return meta.get("intent") or "hiring"
 
-def _infer_stage(prev: Optional[str], user_text: str) -> str:
-    t = (user_text or "").lower()
+def _infer_stage(prev: Optional[str], user_text: str, sig: "Optional[set[str]]" = None) -> str:
+    f = _signals(user_text) if sig is None else sig
+    otp = "otp" in f or "code" in f
+    loc_and_money = "loc" in f and "money" in f
     if prev:
         if prev == "collect":
-            if any(k in t for k in ["verify","otp"]) or re.search(r"\b\d{6}\b", t): return "verify"
-            if any(k in t for k in ["remote","onsite","hybrid","ahmedabad","mumbai","delhi","india","pune","bangalore"]) and any(k in t for k in ["₹","$","lpa","budget","ctc","per month","per hour","salary"]): return "enrich"
+            if otp: return "verify"
+            if loc_and_money: return "enrich"
             return "collect"
         if prev == "verify":
-            if "verified" in t or re.search(r"\b\d{6}\b", t): return "enrich"
+            if "verified" in f or "code" in f: return "enrich"
             return "verify"
         if prev == "enrich":
-            if any(k in t for k in ["shortlist","match","recommend"]): return "match"
+            if "match" in f: return "match"
             return "enrich"
         if prev == "match":
-            if "schedule" in t or "interview" in t: return "schedule"
+            if "sched" in f: return "schedule"
             return "match"
         return prev
-    if "schedule" in t or "interview" in t: return "schedule"
-    if any(k in t for k in ["shortlist","match","recommend"]): return "match"
-    if any(k in t for k in ["remote","onsite","hybrid","ahmedabad","mumbai","delhi","india","pune","bangalore"]) and any(k in t for k in ["₹","$","lpa","budget","ctc","per month","per hour","salary"]): return "enrich"
-    if any(k in t for k in ["verify","otp"]) or re.search(r"\b\d{6}\b", t): return "verify"
+    if "sched" in f: return "schedule"
+    if "match" in f: return "match"
+    if loc_and_money: return "enrich"
+    if otp: return "verify"
     return "collect"
 
+def _infer(prev: Optional[str], user_text: str, meta: Dict[str, Any]) -> "Tuple[str, str]":
+    """(intent, stage) from a single scan of the text."""
+    sig = _signals(user_text)
+    return _infer_intent(user_text, meta, sig), _infer_stage(prev, user_text, sig)
+
 # Simple prompt loader (fallback; wire Supabase later if you want)
-_prompt_cache: Dict[str, str] = {}
+# Few (intent, stage) combos: built once each, interned so every turn shares one string.
+@lru_cache(maxsize=64)
 def _load_prompt(intent: str, stage: str) -> str:
-    key = f"{intent}:{stage}"
-    if key in _prompt_cache:
-        return _prompt_cache[key]
-    content = (
+    return sys.intern(
         f"# POLICY\n"
         f"- Scope: {intent}.\n"
         f"- Be concise; ask only what is required to advance the stage.\n\n"
@@ -86,26 +164,67 @@ def _load_prompt(intent: str, stage: str) -> str:
         f"# OUTPUT STYLE\n"
         f"- 1–2 short sentences, then 2–3 concise suggestions if helpful.\n"
     )
-    _prompt_cache[key] = content
-    return content
+
+# (cid, limit) -> (conversation version, joined CONTEXT); rebuilt only after the history changes
+_CTX_CACHE: "LRUCache[Tuple[str, int], Tuple[int, str]]" = LRUCache(maxsize=int(os.getenv("CTX_CACHE_MAX", "10000")))
+
+# CONTEXT token budget: oldest rows are dropped first so policy + state + context stay in the window
+MAX_CTX_TOKENS = int(os.getenv("MAX_CTX_TOKENS", "1500"))
+_ROW_TOKENS: "LRUCache[str, int]" = LRUCache(maxsize=50_000)   # mid -> token count of its CONTEXT line
+
+@lru_cache(maxsize=1)
+def _encoder():
+    """Loaded on first use: importing the router shouldn't pull BPE tables into every worker.
+    None (cached, so not retried per line) when the tables can't be loaded."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+def _count_tokens(line: str) -> int:
+    enc = _encoder()
+    return len(enc.encode(line)) if enc else len(line) // 4 + 1   # ~4 chars per token
 
 def _build_context(cid: str, limit: int = 8) -> str:
+    version = conversation_version(cid)
+    hit = _CTX_CACHE.get((cid, limit))
+    if hit is not None and version is not None and hit[0] == version:
+        return hit[1]
     rows = list_recent(cid, limit=limit)
     parts = []
-    for r in rows:
+    budget, full = MAX_CTX_TOKENS, False
+    # newest first; once a turn no longer fits only system rows (goals) still go in, and only
+    # while they fit too, so CONTEXT never exceeds MAX_CTX_TOKENS
+    for r in reversed(rows):
         role = (r.get("role") or "user").upper()
         text = (r.get("text") or "")[:300]
-        parts.append(f"{role}: {text}")
-    return "\n".join(parts)
-
-def _sync_openai_chat(messages: List[Dict[str, str]], user: str) -> str:
-    resp = openai.ChatCompletion.create(
-        model=OPENAI_CHAT_MODEL,
-        messages=messages,
-        user=user,
-        temperature=0.3
-    )
-    return (resp.choices[0].message["content"] or "").strip()
+        line = f"{role}: {text}"
+        mid = r.get("mid")
+        n = _ROW_TOKENS.get(mid) if mid else None
+        if n is None:
+            n = _count_tokens(line)
+            if mid: _ROW_TOKENS[mid] = n
+        if n <= budget and (role == "SYSTEM" or not full):
+            parts.append(line)
+            budget -= n
+        elif role != "SYSTEM":
+            full = True
+    parts.reverse()
+    ctx = "\n".join(parts)
+    if version is not None:
+        _CTX_CACHE[(cid, limit)] = (version, ctx)
+    return ctx
+
+async def _async_openai_chat(messages: List[Dict[str, str]], user: str) -> str:
+    async with llm_slot():
+        resp = await get_client().chat.completions.create(
+            model=OPENAI_CHAT_MODEL,
+            messages=messages,
+            user=user,
+            temperature=0.3
+        )
+    return (resp.choices[0].message.content or "").strip()
 def _slots_to_summary(slots: Dict[str, Any]) -> str:
     if not slots: return "none"
     parts = []
@@ -194,7 +313,63 @@ def _reply_for_enrich(slots: Dict[str, Any]) -> str:
         "Also confirm the **seniority** (e.g., junior/mid/senior)."
     )
 
+# Whole-message smalltalk: answered from a template, no context read, no LLM call.
+_TRIVIAL_PATTERNS: Dict[str, "re.Pattern[str]"] = {
+    "greeting": re.compile(r"^\s*(hi+|hello|hey+|hiya|good\s+(morning|afternoon|evening))\b[\s!.,]*(there)?[\s!.]*$", re.I),
+    "thanks":   re.compile(r"^\s*(thanks|thank\s+you|thx|ty|cheers)(\s+(a\s+lot|so\s+much|again))?[\s!.]*$", re.I),
+    "identity": re.compile(r"^\s*(who|what)\s+are\s+you\s*\??\s*$", re.I),
+}
+_TRIVIAL_REPLIES = {
+    "greeting": "Hi! Tell me about the role you’re hiring for — title, budget and location are a great start.",
+    "thanks":   "You’re welcome! Anything else to add to the role?",
+    "identity": "I’m Talent Sourcer GPT — I help you pin down a hiring need and match it with talent.",
+}
+
+def _trivial_intent(text: str) -> Optional[str]:
+    if not text or len(text) > 40:
+        return None
+    for name, pat in _TRIVIAL_PATTERNS.items():
+        if pat.match(text):
+            return name
+    return None
+
 # ---------- The function your chat_router imports ----------
+# Byte-identical on every turn; the CURRENT STATE block it refers to follows in its own message.
+_RUN_TURN_SYSTEM = (
+    "You are Talent Sourcer GPT. Follow the policy and instructions.\n"
+    "---POLICY & INSTRUCTIONS---\n"
+    "# POLICY\n"
+    "- Be concise. Ask ONLY for what is missing.\n"
+    "- NEVER ask again for fields already provided.\n\n"
+    "# GOAL\n"
+    "- Use the CURRENT STATE message (Stage / Known / Missing).\n"
+    "- If Missing is empty, move forward (enrich/match) based on the role.\n"
+    "- Otherwise, ask for the top 1–2 missing items.\n"
+    "- Start with a one-line “Noted …” summary when new info is provided.\n\n"
+    "Respond in 1–2 short sentences."
+)
+_RUN_TURN_SYSTEM_MSG = {"role": "system", "content": _RUN_TURN_SYSTEM}
+
+# Same conversation + same CONTEXT + same state + same (normalized) user text → reuse the model's
+# reply instead of another call (in practice: retries/resends of a turn). The reply is built from
+# the conversation's own memory, so it's never shared across entities or conversations. 0 TTL disables.
+LLM_REPLY_CACHE_TTL = float(os.getenv("LLM_REPLY_CACHE_TTL", "3600"))
+_REPLY_CACHE: "TTLCache[int, str]" = TTLCache(maxsize=int(os.getenv("LLM_REPLY_CACHE_MAX", "10000")), ttl=LLM_REPLY_CACHE_TTL or 1)
+_RE_CODE = re.compile(r"\b\d{6}\b")   # OTPs are one-off: never cache those turns
+
+def _reply_key(entity_id: str, cid: str, ctx: str, state_md: str, slots: Dict[str, Any], user_text: str) -> Optional[int]:
+    if LLM_REPLY_CACHE_TTL <= 0 or _RE_CODE.search(user_text):
+        return None
+    norm = " ".join(user_text.lower().split())
+    try:
+        raw = orjson.dumps(
+            [entity_id, cid, xxhash.xxh3_64_hexdigest(ctx.encode()), state_md, slots, norm],
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+    except TypeError:   # client-sent slots that aren't plain JSON
+        return None
+    return xxhash.xxh3_128_intdigest(raw)
+
 async def run_llm_turn(
     *,
     cid: str,
@@ -203,8 +378,11 @@ async def run_llm_turn(
     platform: str,
     thread_id: str,
     user_id: str,
-    meta: Dict[str, Any] | None = None
+    meta: Dict[str, Any] | None = None,
+    fallback: Optional[str] = None,
 ) -> Dict[str, Any]:
+    """One model-written reply for a chat turn; `fallback` (or a generic ask) when there's no key,
+    the call fails or it times out."""
     meta = meta or {}
     slots = meta.get("slots") or {}
 
@@ -218,40 +396,13 @@ async def run_llm_turn(
     missing = _missing_from_slots(slots)
     known_summary = _slots_to_summary(slots)
 
-    prompt_md = (
-        f"# POLICY\n"
-        f"- Be concise. Ask ONLY for what is missing.\n"
-        f"- NEVER ask again for fields already provided.\n\n"
+    state_md = (
         f"# CURRENT STATE\n"
         f"- Stage: {stage}\n"
         f"- Known: {known_summary}\n"
-        f"- Missing: {', '.join(missing) if missing else 'none'}\n\n"
-        f"# GOAL\n"
-        f"- If Missing is empty, move forward (enrich/match) based on the role.\n"
-        f"- Otherwise, ask for the top 1–2 missing items.\n"
-        f"- Start with a one-line “Noted …” summary when new info is provided.\n"
+        f"- Missing: {', '.join(missing) if missing else 'none'}\n"
     )
 
-    ctx = _build_context(cid, limit=8)
-    system_text = (
-        "You are Talent Sourcer GPT. Follow the policy and instructions.\n"
-        f"---POLICY & INSTRUCTIONS---\n{prompt_md}\n"
-        "Respond in 1–2 short sentences."
-    )
-
-    messages = [
-        {"role": "system", "content": system_text},
-        {"role": "system", "content": f"CONTEXT:\n{ctx}"},
-        {"role": "user", "content": user_text}
-    ]
-
-    text = "Thanks—what’s the target budget and location/remote preference?"
-    if OPENAI_API_KEY:
-        try:
-            text = await asyncio.to_thread(_sync_openai_chat, messages, user_id)
-        except Exception:
-            pass
-
     # Suggestions based on what's still missing
     sug = []
     if "budget" in missing:   sug.append("Share budget")
@@ -262,4 +413,32 @@ async def run_llm_turn(
     if not sug:  # nothing missing → enrich path
         sug = ["Add must-have skills", "Add screening questions", "Ask for sample JD"]
 
+    # Reflex path: smalltalk gets a canned reply; skip the context read and the model
+    trivial = _trivial_intent(user_text)
+    if trivial:
+        return {"text": _TRIVIAL_REPLIES[trivial], "intent": "hiring", "stage": stage, "tool_calls": [], "suggestions": sug, "slots": slots}
+
+    ctx = _build_context(cid, limit=8)   # version-cached: cheap to build before the lookup
+    key = _reply_key(entity_id, cid, ctx, state_md, slots, user_text)
+    cached = _REPLY_CACHE.get(key) if key is not None else None
+    if cached is not None:
+        return {"text": cached, "intent": "hiring", "stage": stage, "tool_calls": [], "suggestions": sug, "slots": slots}
+
+    # static prefix first (provider prompt cache matches on exact prefix), per-turn state after it
+    messages = [
+        _RUN_TURN_SYSTEM_MSG,
+        {"role": "system", "content": state_md},
+        {"role": "system", "content": f"CONTEXT:\n{ctx}"},
+        {"role": "user", "content": user_text}
+    ]
+
+    text = fallback or "Thanks—what’s the target budget and location/remote preference?"
+    if OPENAI_API_KEY:
+        try:
+            text = await asyncio.wait_for(_async_openai_chat(messages, user_id), timeout=LLM_TIMEOUT_SECS)
+            if key is not None and text:
+                _REPLY_CACHE[key] = text
+        except Exception:   # incl. timeout → deterministic fallback text
+            pass
+
     return {"text": text, "intent": "hiring", "stage": stage, "tool_calls": [], "suggestions": sug, "slots": slots}
@@ -4,13 +4,18 @@ from pydantic import BaseModel, Field
 from typing import Any, Dict, Optional, List
 
 # import the service-layer functions
-from services.memory_store import ensure_conversation as _ensure_conv, ingest_message as _ingest_msg, list_recent
+from services.memory_store import (
+    ensure_conversation as _ensure_conv, ingest_message as _ingest_msg,
+    ingest_messages as _ingest_msgs, ingest_messages_bulk as _ingest_bulk, list_recent,
+)
 
 router = APIRouter(prefix="", tags=["memory"])
 
 # ---- Re-export for internal Python imports (inside this repo) ----
 ensure_conversation = _ensure_conv
 ingest_message = _ingest_msg
+ingest_messages = _ingest_msgs
+ingest_messages_bulk = _ingest_bulk
 
 class EnsureReq(BaseModel):
     entity_id: str
@@ -43,6 +48,33 @@ def messages_ingest(req: IngestReq, Idempotency_Key: Optional[str] = Header(None
     mid = ingest_message(cid, req.role, req.content, req.meta, idem)
     return {"ok": True, "cid": cid, "mid": mid}
 
+class IngestRow(BaseModel):
+    role: str = Field(default="user")
+    content: str
+    meta: Dict[str, Any] = Field(default_factory=dict)
+    idem: Optional[str] = None
+
+class IngestBatchReq(BaseModel):
+    cid: Optional[str] = None
+    entity_id: str
+    platform: str
+    thread_id: str
+    user_id: str
+    rows: List[IngestRow]
+
+@router.post("/messages.ingest_batch")
+def messages_ingest_batch(req: IngestBatchReq, Idempotency_Key: Optional[str] = Header(None)):
+    """Several messages (e.g. a user + assistant turn) in one write."""
+    if any(r.role not in {"user","assistant","tool","system"} for r in req.rows):
+        raise HTTPException(400, "invalid role")
+    cid = req.cid or ensure_conversation(req.entity_id, req.platform, req.thread_id)
+    # without a header key, rows without an idem fall back to the same key /messages.ingest uses
+    rows = [{"role": r.role, "text": r.content, "meta": r.meta,
+             "idem": r.idem or (None if Idempotency_Key else f"{req.user_id}:{r.role}:{hash(r.content)}")}
+            for r in req.rows]
+    mids = ingest_messages(cid, rows, idem_prefix=Idempotency_Key)
+    return {"ok": True, "cid": cid, "mids": mids}
+
 @router.get("/conversations/{cid}/context")
 def conversations_context(cid: str, limit: int = Query(8, ge=1, le=20)):
     rows = list_recent(cid, limit=limit)
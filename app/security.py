@@ -1,14 +1,17 @@
 # memory_service/security.py
 import os
+import hmac
 from fastapi import Header, HTTPException
 
+# read once at import; set this in the Memory Service env
+_EXPECTED = os.getenv("MEMORY_TOKEN", "").encode()
+
 def require_internal_token(authorization: str = Header(None)):
-    expected = os.getenv("MEMORY_TOKEN", "")  # set this in the Memory Service env
-    if not expected:
+    if not _EXPECTED:
         # auth disabled (dev). Set SERVICE_AUTH_TOKEN in prod to enforce.
         return
-    if not authorization or not authorization.lower().startswith("bearer "):
+    if not authorization or authorization[:7].lower() != "bearer ":
         raise HTTPException(401, "Missing bearer token")
-    token = authorization.split(" ", 1)[1]
-    if token != expected:
+    token = authorization[7:]
+    if not hmac.compare_digest(token.encode(), _EXPECTED):
         raise HTTPException(401, "Invalid service token")
@@ -0,0 +1,31 @@
+# services/batching.py
+# Micro-batching shared by the background writers/searchers: wait for one item, then
+# take whatever else arrives within a short window (bounded by a max batch size).
+from __future__ import annotations
+import asyncio
+from typing import Any, List, Optional
+
+async def drain(queue: asyncio.Queue, max_items: int, window: float, into: Optional[List[Any]] = None) -> List[Any]:
+    """Block for one item, then keep collecting until the window closes or the batch is full.
+    Items are appended to `into` as they arrive, so a caller cancelled mid-window still has them."""
+    loop = asyncio.get_running_loop()
+    batch = [] if into is None else into
+    batch.append(await queue.get())
+    deadline = loop.time() + window
+    while len(batch) < max_items:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        # not wait_for: on 3.10/3.11 it can swallow a cancel() that lands as the get completes,
+        # leaving a shutdown waiting on a worker that never stops
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait((getter,), timeout=remaining)
+        finally:
+            getter.cancel()   # no-op once it holds an item
+            got = getter.done() and not getter.cancelled()
+            if got:
+                batch.append(getter.result())
+        if not got:
+            break
+    return batch
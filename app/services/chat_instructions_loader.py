@@ -7,6 +7,7 @@ import time
 import asyncio
 import httpx
 import hashlib
+from functools import lru_cache
 from typing import Dict, Optional, Tuple
 from supabase import create_client, Client
 PROMPT_FETCH_MODE = os.getenv("PROMPT_FETCH_MODE", "signed")  # signed|direct
@@ -46,6 +47,22 @@ _cache_lkg: Dict[str, str] = {}  # last-known-good
 _cache_hash: Dict[str, str] = {}  # sha256 of content
 _locks: Dict[str, asyncio.Lock] = {}
 
+@lru_cache(maxsize=1)
+def _http() -> httpx.AsyncClient:
+    """One keep-alive client for signed-URL fetches (refreshes reuse the TLS connection)."""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        timeout=httpx.Timeout(connect=5.0, read=8.0, write=5.0, pool=5.0),
+        follow_redirects=True,
+    )
+
+async def close_http() -> None:
+    """Close the pool on shutdown (no-op if nothing was fetched)."""
+    if _http.cache_info().currsize:
+        await _http().aclose()
+        _http.cache_clear()
+
 def _lock_for(key: str) -> asyncio.Lock:
     if key not in _locks:
         _locks[key] = asyncio.Lock()
@@ -88,11 +105,9 @@ async def _fetch_via_signed_url(file_path: str, ttl_sec: int = 3600) -> str:
     signed = res.get("signedURL") or res.get("signed_url")  # client versions differ
     if not signed:
         raise RuntimeError("No signed URL returned from Supabase")
-    timeout = httpx.Timeout(connect=5.0, read=8.0, write=5.0, pool=5.0)
-    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
-        r = await client.get(signed, headers={"Accept": "text/plain"})
-        r.raise_for_status()
-        return _sanitize_text(r.content)
+    r = await _http().get(signed, headers={"Accept": "text/plain"})
+    r.raise_for_status()
+    return _sanitize_text(r.content)
 
 async def _fetch_fresh(file_path: str) -> str:
     if PROMPT_FETCH_MODE == "direct":
@@ -152,6 +167,13 @@ async def get_prompt_for(label: str, force_refresh: bool = False) -> str:
                 return _cache_lkg[file_path]
             raise RuntimeError(f"Prompt load failed for '{file_path}': {e}")
 
+def get_cached_prompt(label: str) -> Optional[str]:
+    """Fresh cached text for a label, or None. No await, no I/O — for hot paths."""
+    file_path = _resolve_file_path(label)
+    if time.time() < _cache_expiry.get(file_path, 0):
+        return _cache_text.get(file_path)
+    return None
+
 def get_prompt_version(label: str) -> Optional[str]:
     """Optional: returns the short sha256 of the current cached prompt (for logging)."""
     file_path = _resolve_file_path(label)
@@ -6,6 +6,10 @@ from services.slot_extraction import extract_slots_from_turn
 
 _SPLITS = re.compile(r"(?:\n|;|\balso\b|\banother\b|, and\b|\band\b(?!\s*remote))", re.I)
 
+def might_have_multiple_jobs(text: str) -> bool:
+    """Cheap gate: with no separator the text is one chunk, so extract_jobs can't return 2+."""
+    return bool(text) and _SPLITS.search(text) is not None
+
 def _split(text: str) -> List[str]:
     if not text: return []
     parts = [p.strip(" .;,-") for p in _SPLITS.split(text) if p and p.strip()]
@@ -2,12 +2,31 @@
 # Single place for data ops used by routers. Swap the in-memory dicts with your DB layer.
 
 from __future__ import annotations
-from typing import Dict, Any
-import time, uuid
+from typing import Dict, Any, List, Tuple
+import os, threading, time, uuid
 
 # --- TEMP in-memory store (replace with your DB/SQLAlchemy) ---
 _CONVS: Dict[str, Dict[str, Any]] = {}
 _MSGS: Dict[str, Dict[str, Any]] = {}
+_IDEM: Dict[Tuple[str, str], str] = {}   # (cid, idempotency_key) -> mid
+_CONV_VERSION: Dict[str, int] = {}       # cid -> bumped on every new message
+# (cid, thread_id) -> slots of the newest row that has them; thread_id "" = any thread.
+# Written on insert, so readers do one dict lookup instead of scanning _MSGS.
+_LATEST_SLOTS: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_RID_SLOTS: Dict[Tuple[str, str], Dict[str, Any]] = {}      # (cid, rid) -> same, per chat request
+
+# 128-bit random ids sliced from one os.urandom read per 256 ids (per thread: writes run
+# in to_thread workers), instead of a urandom syscall per uuid4()
+_ID_BATCH = 256
+_ids = threading.local()
+os.register_at_fork(after_in_child=lambda: _ids.__dict__.clear())   # forked workers must not replay the parent's ids
+
+def _new_id() -> str:
+    i = getattr(_ids, "i", _ID_BATCH)
+    if i == _ID_BATCH:
+        _ids.buf, i = os.urandom(16 * _ID_BATCH), 0
+    _ids.i = i + 1
+    return _ids.buf[16 * i:16 * i + 16].hex()
 
 def _conv_key(entity_id: str, platform: str, thread_id: str) -> str:
     return f"{entity_id}:{platform}:{thread_id}"
@@ -25,17 +44,54 @@ def ensure_conversation(entity_id: str, platform: str, thread_id: str) -> str:
 def ingest_message(cid: str, role: str, text: str, meta: Dict[str, Any] | None, idempotency_key: str) -> str:
     """Idempotent insert by idempotency_key; returns message id."""
     # idempotency: same key → return existing
-    for mid, row in _MSGS.items():
-        if row.get("cid")==cid and row.get("idempotency_key")==idempotency_key:
-            return mid
-    mid = uuid.uuid4().hex
+    mid = _IDEM.get((cid, idempotency_key))
+    if mid:
+        return mid
+    mid = _new_id()
     _MSGS[mid] = {
         "cid": cid, "role": role, "text": text or "", "meta": meta or {},
         "idempotency_key": idempotency_key, "ts": time.time()
     }
+    _IDEM[(cid, idempotency_key)] = mid
+    _CONV_VERSION[cid] = _CONV_VERSION.get(cid, 0) + 1
+    slots = (meta or {}).get("slots")
+    if isinstance(slots, dict):
+        _LATEST_SLOTS[(cid, "")] = slots
+        if meta.get("thread_id"):
+            _LATEST_SLOTS[(cid, meta["thread_id"])] = slots
+        if meta.get("rid"):
+            _RID_SLOTS[(cid, meta["rid"])] = slots
     return mid
 
+def ingest_messages(cid: str, rows: List[Dict[str, Any]], idem_prefix: str | None = None) -> List[str]:
+    """Insert several messages in one call; rows are {role, text, meta, idem}. Returns mids in order.
+    Rows without an idem get f"{idem_prefix}:{i}" (position in the batch)."""
+    prefix = idem_prefix or _new_id()
+    return [
+        ingest_message(cid, r["role"], r.get("text") or "", r.get("meta"), r.get("idem") or f"{prefix}:{i}")
+        for i, r in enumerate(rows)
+    ]
+
+def ingest_messages_bulk(batches: List[Tuple[str, List[Dict[str, Any]]]]) -> List[List[str]]:
+    """Several conversations' rows in one call: [(cid, rows), ...] -> mids per batch.
+    One round-trip for a DB layer (a single multi-row insert)."""
+    return [ingest_messages(cid, rows) for cid, rows in batches]
+
+def conversation_version(cid: str) -> int:
+    """Changes whenever cid gains a message; lets callers cache views of its history."""
+    return _CONV_VERSION.get(cid, 0)
+
 def list_recent(cid: str, limit: int = 8) -> list[dict]:
     rows = [r | {"mid": mid} for mid, r in _MSGS.items() if r["cid"] == cid]
     rows.sort(key=lambda r: r["ts"])  # chronological
     return rows[-limit:]
+
+def latest_slots(cid: str, thread_id: str = "") -> Dict[str, Any] | None:
+    """Slots of the newest row for cid (optionally one thread) that has them; None if no row does.
+    Rows without a thread_id only count for the any-thread lookup.
+    DB layer: ORDER BY ts DESC LIMIT 1 over rows whose meta has slots."""
+    return _LATEST_SLOTS.get((cid, thread_id))
+
+def request_slots(cid: str, rid: str) -> Dict[str, Any] | None:
+    """Slots of the newest row stored for chat request rid; None if the store never saw it."""
+    return _RID_SLOTS.get((cid, rid))
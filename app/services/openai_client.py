@@ -0,0 +1,67 @@
+# services/openai_client.py
+# One AsyncOpenAI client per process, backed by a single keep-alive httpx pool,
+# so LLM calls reuse TCP/TLS connections instead of handshaking per request.
+from __future__ import annotations
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator
+
+import httpx
+from openai import AsyncOpenAI
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+LLM_TIMEOUT_SECS = float(os.getenv("LLM_TIMEOUT_SECS", "18"))
+# process-wide admission for LLM calls: in-flight cap + request pacing (0 = no pacing).
+# The other limits default off this one: the pool never needs more connections than calls
+# in flight, and callers' own caps (e.g. LLM_REWRITE_CONCURRENCY) take a share of it.
+OPENAI_MAX_INFLIGHT = int(os.getenv("OPENAI_MAX_INFLIGHT", "64"))
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "0"))
+# pool sizing, tunable per deployment (plan limits / worker count differ)
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(OPENAI_MAX_INFLIGHT)))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", str(max(1, OPENAI_MAX_CONNECTIONS // 2))))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"
+# SDK default is 2 retries, each up to the read timeout: keep it at 1 so callers'
+# LLM_TIMEOUT_SECS deadline actually bounds the call
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+
+_inflight = asyncio.Semaphore(OPENAI_MAX_INFLIGHT)
+_next_at = 0.0
+
+@lru_cache(maxsize=1)
+def get_client() -> AsyncOpenAI:
+    """Created lazily: AsyncOpenAI refuses to construct without an API key."""
+    http = httpx.AsyncClient(
+        http2=OPENAI_HTTP2,   # many concurrent calls multiplexed over few TLS connections
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        # short connect/pool waits: under saturation fail fast instead of queueing for the full read timeout
+        timeout=httpx.Timeout(connect=2.0, read=LLM_TIMEOUT_SECS, write=2.0, pool=1.0),
+    )
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http, max_retries=OPENAI_MAX_RETRIES)
+
+async def close_client() -> None:
+    """Close the pool on shutdown (no-op if no LLM call ever created it)."""
+    if get_client.cache_info().currsize:
+        await get_client().close()
+        get_client.cache_clear()
+
+@asynccontextmanager
+async def llm_slot() -> AsyncIterator[None]:
+    """Wrap every OpenAI call: bursts queue here (and are spaced to OPENAI_RPM)
+    instead of fanning out into 429s and retry storms."""
+    global _next_at
+    async with _inflight:
+        if OPENAI_RPM > 0:
+            now = asyncio.get_running_loop().time()
+            at = max(now, _next_at)
+            _next_at = at + 60.0 / OPENAI_RPM
+            if at > now:
+                await asyncio.sleep(at - now)
+        yield
+
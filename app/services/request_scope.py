@@ -7,6 +7,7 @@ from typing import Dict, Any, Optional, List
 _requests: Dict[str, Dict[str, Any]] = {}     # rid -> request object
 _thread_active: Dict[str, str] = {}           # thread_id -> active rid
 _thread_index: Dict[str, List[str]] = {}      # thread_id -> [rid, ...]
+_thread_version: Dict[str, int] = {}          # thread_id -> bumped on every request change
 
 def _now() -> float: return time.time()
 def _mkid() -> str: return uuid.uuid4().hex
@@ -24,6 +25,15 @@ def summarize(r: Dict[str, Any]) -> Dict[str, Any]:
 def list_requests_for_thread(thread_id: str) -> List[Dict[str, Any]]:
     return [summarize(_requests[r]) for r in _thread_index.get(thread_id, []) if r in _requests]
 
+def thread_version(thread_id: str) -> int:
+    return _thread_version.get(thread_id, 0)
+
+def thread_request_count(thread_id: str) -> int:
+    return len(_thread_index.get(thread_id, ()))
+
+def _bump(thread_id: str) -> None:
+    _thread_version[thread_id] = _thread_version.get(thread_id, 0) + 1
+
 def get_active_rid(thread_id: str) -> Optional[str]:
     return _thread_active.get(thread_id)
 
@@ -43,6 +53,7 @@ def begin_request(cid: str, thread_id: str, seed_slots: Dict[str, Any] | None =
     _requests[rid] = obj
     _thread_index.setdefault(thread_id, []).append(rid)
     _thread_active[thread_id] = rid
+    _bump(thread_id)
     return rid
 
 def update_request(rid: str, *, slots: Dict[str, Any] | None = None, stage: Optional[str] = None, title: Optional[str] = None) -> None:
@@ -52,6 +63,7 @@ def update_request(rid: str, *, slots: Dict[str, Any] | None = None, stage: Opti
     if stage is not None: r["stage"] = stage
     if title is not None: r["title"] = title
     r["updated_at"] = _now()
+    _bump(r["thread_id"])
 
 def ensure_active_request(cid: str, thread_id: str, seed_slots: Dict[str, Any] | None = None) -> str:
     rid = get_active_rid(thread_id)
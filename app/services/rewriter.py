@@ -1,41 +1,73 @@
 # services/rewriter.py
 from __future__ import annotations
-import os, asyncio
-from typing import Optional
-import openai
+import os, logging
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from cachetools import LRUCache
+
+from services.openai_client import OPENAI_API_KEY, get_client, llm_slot
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 REWRITE_MODEL  = os.getenv("OPENAI_REWRITE_MODEL", os.getenv("OPENAI_CHAT_MODEL","gpt-3.5-turbo"))
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "2048"))
+
+log = logging.getLogger(__name__)
+
+# Replies fed to the rewriter are templated (ask_builder), so the same input
+# text recurs across users; cache the rewritten output per (text, tone, policy).
+_cache: "LRUCache[Tuple[str, str, Optional[str]], str]" = LRUCache(maxsize=REWRITE_CACHE_SIZE)
+_cache_hits = 0
+_cache_misses = 0
+
+def cache_stats() -> Dict[str, int]:
+    return {"size": len(_cache), "hits": _cache_hits, "misses": _cache_misses}
 
+_SYSTEM_BASE = (
+    "You are a careful copy editor for a recruiting assistant.\n"
+    "Rewrite the assistant's reply for tone/clarity ONLY—do NOT change meaning, "
+    "requested fields, or stage hints.\n"
+    "- Keep facts/placeholders/bullets intact.\n"
+    "- Aim for concise, friendly, business-casual."
+)
+
+@lru_cache(maxsize=32)
+def _system_msg(policy: Optional[str], tone: str) -> Dict[str, str]:
+    return {"role": "system", "content": _system(policy, tone)}
+
+@lru_cache(maxsize=32)
 def _system(policy: Optional[str], tone: str) -> str:
-    base = (
-        "You are a careful copy editor for a recruiting assistant.\n"
-        "Rewrite the assistant's reply for tone/clarity ONLY—do NOT change meaning, "
-        "requested fields, or stage hints.\n"
-        "- Keep facts/placeholders/bullets intact.\n"
-        "- Aim for concise, friendly, business-casual."
-    )
-    if tone:   base += f"\nTone hint: {tone}"
-    if policy: base += f"\n\n[POLICY EXCERPT]\n{policy}"
+    # Byte-stable per (policy, tone) so the provider's prompt-prefix cache hits:
+    # the long policy text leads, short varying hints come last.
+    base = f"[POLICY EXCERPT]\n{policy}\n\n{_SYSTEM_BASE}" if policy else _SYSTEM_BASE
+    if tone: base += f"\nTone hint: {tone}"
     return base
 
 async def rewrite(text: str, tone: str = "concise, friendly", policy: Optional[str] = None) -> str:
+    global _cache_hits, _cache_misses
     if not text or not OPENAI_API_KEY:
         return text
 
-    sys = _system(policy, tone)
-    usr = f"Rewrite this text without changing meaning or asks:\n---\n{text}\n---"
+    key = (text, tone, policy)
+    cached = _cache.get(key)
+    if cached is not None:
+        _cache_hits += 1
+        return cached
+    _cache_misses += 1
 
-    def _call():
-        openai.api_key = OPENAI_API_KEY
-        r = openai.ChatCompletion.create(
-            model=REWRITE_MODEL,
-            messages=[{"role":"system","content":sys},{"role":"user","content":usr}],
-            temperature=0.2,
-        )
-        return (r.choices[0].message["content"] or "").strip()
+    usr = f"Rewrite this text without changing meaning or asks:\n---\n{text}\n---"
 
     try:
-        return await asyncio.to_thread(_call)
+        async with llm_slot():
+            r = await get_client().chat.completions.create(
+                model=REWRITE_MODEL,
+                messages=[_system_msg(policy, tone), {"role":"user","content":usr}],
+                temperature=0.2,
+            )
+        out = (r.choices[0].message.content or "").strip()
     except Exception:
         return text
+    details = getattr(r.usage, "prompt_tokens_details", None)
+    if details is not None:
+        log.debug("rewrite: %d cached prompt tokens", details.cached_tokens or 0)
+    if out:
+        _cache[key] = out
+    return out or text
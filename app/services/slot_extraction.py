@@ -35,8 +35,10 @@ def location(text: str) -> Optional[str]:
             return _titlecase_city(m.group(1))
     return None
 
+_WS_RE = re.compile(r"\s+")
+
 def _norm_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", s or "").strip()
+    return _WS_RE.sub(" ", s or "").strip()
 
 def _num(x: str) -> float:
     return float(x.replace(",", "").replace(" ", ""))
@@ -77,6 +79,14 @@ _ROLE_KEYWORDS = [
   "java developer","golang developer","node developer","react developer","product manager",
   "qa","tester","analyst","architect","scientist","designer","manager","developer","engineer"
 ]
+_ROLE_PATTERNS = [
+    (kw, re.compile(rf"\b([a-z][a-z0-9\-\s]{{0,30}}{re.escape(kw)})\b")) for kw in _ROLE_KEYWORDS
+]
+
+_SENIORITY_PATTERNS = [
+    (s, re.compile(rf"\b{s}\b", re.I))
+    for s in ["intern","junior","associate","mid","mid-level","senior","lead","principal","staff","director","vp","head"]
+]
 
 # Canonical tech names (expand as you like)
 _TECH_CANONICAL: Dict[str, str] = {
@@ -128,30 +138,40 @@ def _canon_tech(tok: str) -> Optional[str]:
     if t2 in _TECH_CANONICAL: return _TECH_CANONICAL[t2]
     return None  # ← critical: reject unknowns
 
+# (term, compiled \b-pattern, canonical) built once; scanned per turn
+_TECH_PATTERNS = [
+    (t, re.compile(rf"\b{re.escape(t)}\b"), _canon_tech(t)) for t in _TECH_TERMS
+]
+
+_STACK_SPLIT_RE = re.compile(r"[,\|/]|(?:\s+and\s+)|(?:\s*&\s*)", re.I)
+
 def _split_stack_phrase(s: str) -> List[str]:
-    parts = re.split(r"[,\|/]|(?:\s+and\s+)|(?:\s*&\s*)", s, flags=re.I)
+    parts = _STACK_SPLIT_RE.split(s)
     return [p.strip() for p in parts if p and p.strip()]
 
 def _scan_known_techs(text: str) -> List[str]:
     low = text.lower()
     found: List[str] = []
-    for term in _TECH_TERMS:
-        if re.search(rf"\b{re.escape(term)}\b", low):
-            c = _canon_tech(term)
-            if c and c not in found:
-                found.append(c)
+    for term, pat, c in _TECH_PATTERNS:
+        # cheap substring check first; most terms are absent from any given turn
+        if c and term in low and c not in found and pat.search(low):
+            found.append(c)
     return found
 
+_DIGIT_RE = re.compile(r"\d")
+
 def _is_garbage_token(tok: str) -> bool:
     """Filter out budget/location bleed like 'inahmedabadfor20-25lpa'."""
     t = tok.lower()
     if len(t) > 24: return True
     if any(x in t for x in [" lpa","lac","lakh","crore","month","year","hr","hour","per ","₹","$","€","£"]): return True
-    if re.search(r"\d", t) and t not in {"c#","c++"}: return True
+    if _DIGIT_RE.search(t) and t not in {"c#","c++"}: return True
     if "in " in t or t.startswith("in") and not t.startswith("int"): return True
     if "for" in t: return True
     return False
 
+_STACK_LEAD_RE = re.compile(rf"(?:{'|'.join(_STACK_LEADS)})\s*[:\-]?\s*(?P<list>.+)$", re.I)
+
 def tech_stack(text: str) -> Optional[List[str]]:
     if not text:
         return None
@@ -159,8 +179,7 @@ def tech_stack(text: str) -> Optional[List[str]]:
     candidates: List[str] = []
 
     # 1) explicit “stack/skills/experience with …”
-    lead = rf"(?:{'|'.join(_STACK_LEADS)})\s*[:\-]?\s*(?P<list>.+)$"
-    m = re.search(lead, low, flags=re.I)
+    m = _STACK_LEAD_RE.search(low)
     if m:
         raw_list = m.group("list")
         for part in _split_stack_phrase(raw_list):
@@ -252,35 +271,43 @@ def budget(text: str) -> Optional[Dict[str, Any]]:
         "raw": raw_span.strip(),
     }
 
+_LOC_IN_AT_RE = re.compile(r"(?i)\b(?:in|at)\s+([A-Z][a-zA-Z\-\s]{2,40})\b")
+
 def location(text: str) -> Optional[str]:
     if not text: return None
     t = text.lower()
     for kw in _LOC_HINTS:
         if kw in t:
             return "Remote" if kw == "remote" else kw
-    m = re.search(r"(?i)\b(?:in|at)\s+([A-Z][a-zA-Z\-\s]{2,40})\b", text)
+    m = _LOC_IN_AT_RE.search(text)
     return _norm_spaces(m.group(1)) if m else None
 
+# role_title patterns, compiled once rather than looked up in re's cache per turn
+_ROLE_LEAD_RE = re.compile(r"(?:need|looking\s+for|hiring)\s+(?:an?\s+|the\s+)?([a-z][a-z0-9\-\s]{2,40})\b")
+_ROLE_TAIL_RE = re.compile(r"\s+(for|at)\s+.*$")
+_ROLE_BEFORE_LOC_RE = re.compile(r"\b([a-z][a-z0-9\-\s]{2,40})\s+(?:in|at)\s+[a-z][a-z\-\s]{2,40}\b")
+_ROLE_NOISE_RE = re.compile(r"\b(lpa|rs|inr|\$|\d|month|mo|yr|year|hour|hr)\b")
+
 def role_title(text: str) -> Optional[str]:
     if not text: return None
     t = text.lower()
 
-    m = re.search(r"(?:need|looking\s+for|hiring)\s+(?:an?\s+|the\s+)?([a-z][a-z0-9\-\s]{2,40})\b", t)
+    m = _ROLE_LEAD_RE.search(t)
     if m:
         cand = _norm_spaces(m.group(1))
-        cand = re.sub(r"\s+(for|at)\s+.*$", "", cand).strip()
-        if not re.match(r"^\d", cand):
+        cand = _ROLE_TAIL_RE.sub("", cand).strip()
+        if not cand[:1].isdecimal():
             return cand
 
-    m = re.search(r"\b([a-z][a-z0-9\-\s]{2,40})\s+(?:in|at)\s+[a-z][a-z\-\s]{2,40}\b", t)
+    m = _ROLE_BEFORE_LOC_RE.search(t)
     if m:
         cand = _norm_spaces(m.group(1))
-        if not re.search(r"\b(lpa|rs|inr|\$|\d|month|mo|yr|year|hour|hr)\b", cand):
+        if not _ROLE_NOISE_RE.search(cand):
             return cand
 
     best = None
-    for kw in _ROLE_KEYWORDS:
-        m = re.search(rf"\b([a-z][a-z0-9\-\s]{{0,30}}{re.escape(kw)})\b", t)
+    for kw, pat in _ROLE_PATTERNS:
+        m = pat.search(t) if kw in t else None
         if m:
             cand = _norm_spaces(m.group(1))
             if not best or len(cand) > len(best):
@@ -289,8 +316,8 @@ def role_title(text: str) -> Optional[str]:
 
 def seniority(text: str) -> Optional[str]:
     if not text: return None
-    for s in ["intern","junior","associate","mid","mid-level","senior","lead","principal","staff","director","vp","head"]:
-        if re.search(rf"\b{s}\b", text, re.I):
+    for s, pat in _SENIORITY_PATTERNS:
+        if pat.search(text):
             return s
     return None
 
@@ -1,6 +1,6 @@
 # services/stage_machine.py
 from __future__ import annotations
-from typing import Dict, Any, List
+from typing import Dict, Any, List, NamedTuple
 
 STAGES = ["collect", "enrich", "match", "schedule", "close"]
 
@@ -99,3 +99,29 @@ def advance_until_stable(current: str, slots: Dict[str, Any]) -> str:
         if nxt == cur:
             return cur
         cur = nxt
+
+# public: everything a turn needs from the machine, in one walk
+class StagePlan(NamedTuple):
+    ask_stage: str        # == next_stage(current, slots)
+    stage_final: str      # == advance_until_stable(current, slots)
+    missing: List[str]    # == missing_for_stage(ask_stage, slots)
+
+def compute_plan(current: str, slots: Dict[str, Any]) -> StagePlan:
+    cur = current if current in STAGES else "collect"
+    miss = missing_for_stage(cur, slots)
+    ask, ask_missing = (cur, miss) if miss else (None, None)
+    seen = set()
+    while cur not in seen:
+        seen.add(cur)
+        if miss:
+            break
+        nxt = NEXT.get(cur, "collect")
+        if nxt == cur:
+            break
+        cur = nxt
+        miss = missing_for_stage(cur, slots)
+        if ask is None:
+            ask, ask_missing = cur, miss
+    if ask is None:       # satisfied terminal stage
+        ask, ask_missing = cur, miss
+    return StagePlan(ask, cur, ask_missing)
@@ -0,0 +1,88 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import chat_router
+from services import request_scope
+from services.memory_store import list_recent
+
+TEXT = "Need a python engineer in Pune for 18-22 LPA"
+
+def _app():
+    app = FastAPI()
+    app.include_router(chat_router.router)
+    return app
+
+@pytest.fixture
+def client():
+    with TestClient(_app()) as c:
+        yield c
+        c.portal.call(chat_router.flush_ingest_queue)   # what the app's shutdown hook does
+
+def _headers():
+    return {"entity-id": "e", "platform": "web", "thread-id": uuid.uuid4().hex, "user-id": "u1"}
+
+def _turn(c, headers, text, **meta):
+    r = c.post("/chat/turn", json={"text": text, "meta": meta}, headers=headers)
+    assert r.status_code == 200
+    return r.json()
+
+def _lose_request_state():   # what a restart does to the in-memory request scope
+    request_scope._requests.clear()
+    request_scope._thread_active.clear()
+    chat_router._SLOT_CACHE.clear()
+
+# ---------- prior slots ----------
+
+def test_new_rid_in_same_thread_starts_empty(client):
+    h = _headers()
+    first = _turn(client, h, TEXT)
+    assert first["meta"]["slots"].get("location")
+    rid = request_scope.begin_request(first["cid"], h["thread-id"])
+    assert _turn(client, h, "ok", rid=rid)["meta"]["slots"] == {}
+
+def test_unknown_rid_starts_empty(client):
+    h = _headers()
+    _turn(client, h, TEXT)
+    assert _turn(client, h, "ok", rid=uuid.uuid4().hex)["meta"]["slots"] == {}
+
+def test_lost_request_state_recovers_from_store(client):
+    h = _headers()
+    first = _turn(client, h, TEXT)
+    rid = first["meta"]["requests"][0]["rid"]
+    client.portal.call(chat_router.flush_ingest_queue)
+    _lose_request_state()
+    assert _turn(client, h, "ok", rid=rid)["meta"]["slots"] == first["meta"]["slots"]
+
+def test_lost_thread_state_without_rid_starts_fresh(client):
+    h = _headers()
+    _turn(client, h, TEXT)
+    client.portal.call(chat_router.flush_ingest_queue)
+    _lose_request_state()
+    assert _turn(client, h, "ok")["meta"]["slots"] == {}
+
+# ---------- persistence ----------
+
+def test_flush_writes_queued_turns(client):
+    out = _turn(client, _headers(), TEXT)
+    client.portal.call(chat_router.flush_ingest_queue)
+    assert [r["role"] for r in list_recent(out["cid"])] == ["user", "assistant"]
+
+def test_flush_waits_for_overflow_writes(client, monkeypatch):
+    full = asyncio.Queue(maxsize=1)
+    full.put_nowait((uuid.uuid4().hex, "", []))   # the turn's put_nowait overflows to _spawn
+    monkeypatch.setattr(chat_router, "_INGEST_QUEUE", full)
+    out = _turn(client, _headers(), TEXT)
+    client.portal.call(chat_router.flush_ingest_queue)
+    assert not chat_router.BACKGROUND_TASKS
+    assert len(list_recent(out["cid"])) == 2
+
+def test_queue_restarts_on_a_new_loop():
+    for _ in range(2):   # each TestClient runs its own event loop
+        with TestClient(_app()) as c:
+            out = _turn(c, _headers(), TEXT)
+            c.portal.call(chat_router.flush_ingest_queue)
+        assert len(list_recent(out["cid"])) == 2
@@ -0,0 +1,100 @@
+import random
+import re
+
+import pytest
+
+from routers.gpt_router import _infer, _infer_intent, _infer_stage, _load_prompt
+
+# ---------- reference: the original keyword-list implementation ----------
+
+_AUTO = ["automation", "zapier", "workflow", "integrate", "make.com"]
+_STAFF = ["staffing", "contractor", "augment"]
+_LOC = ["remote", "onsite", "hybrid", "ahmedabad", "mumbai", "delhi", "india", "pune", "bangalore"]
+_MONEY = ["₹", "$", "lpa", "budget", "ctc", "per month", "per hour", "salary"]
+_MATCH = ["shortlist", "match", "recommend"]
+
+def _old_intent(user_text, meta):
+    t = (user_text or "").lower()
+    if any(k in t for k in _AUTO): return "automation"
+    if any(k in t for k in _STAFF): return "staffing"
+    return meta.get("intent") or "hiring"
+
+def _old_stage(prev, user_text):
+    t = (user_text or "").lower()
+    otp = any(k in t for k in ["verify", "otp"]) or re.search(r"\b\d{6}\b", t)
+    loc_and_money = any(k in t for k in _LOC) and any(k in t for k in _MONEY)
+    sched = "schedule" in t or "interview" in t
+    if prev:
+        if prev == "collect":
+            if otp: return "verify"
+            if loc_and_money: return "enrich"
+            return "collect"
+        if prev == "verify":
+            if "verified" in t or re.search(r"\b\d{6}\b", t): return "enrich"
+            return "verify"
+        if prev == "enrich":
+            if any(k in t for k in _MATCH): return "match"
+            return "enrich"
+        if prev == "match":
+            if sched: return "schedule"
+            return "match"
+        return prev
+    if sched: return "schedule"
+    if any(k in t for k in _MATCH): return "match"
+    if loc_and_money: return "enrich"
+    if otp: return "verify"
+    return "collect"
+
+PREVS = [None, "collect", "verify", "enrich", "match", "schedule", "other"]
+
+# ---------- hand-picked cases (touching / overlapping keywords) ----------
+
+@pytest.mark.parametrize("text", [
+    "",
+    None,
+    "hybridelhi budget",
+    "remote$",
+    "Pune, 18 LPA",
+    "mumbaictc",
+    "verified 123456",
+    "code 1234567",
+    "OTP:123456",
+    "shortlistmatch then schedule",
+    "interview on Monday",
+    "makexcom automation",
+    "Zapier workflow for contractor staffing",
+    "augmented team in india per month",
+])
+def test_infer_matches_keyword_lists(text):
+    for prev in PREVS:
+        assert _infer_stage(prev, text) == _old_stage(prev, text)
+        assert _infer(prev, text, {})[1] == _old_stage(prev, text)
+    assert _infer_intent(text, {}) == _old_intent(text, {})
+    assert _infer(None, text, {})[0] == _old_intent(text, {})
+
+def test_infer_intent_falls_back_to_meta():
+    assert _infer_intent("hello", {"intent": "staffing"}) == "staffing"
+    assert _infer_intent("zapier please", {"intent": "staffing"}) == "automation"
+
+# ---------- randomized agreement ----------
+
+_WORDS = _AUTO + _STAFF + _LOC + _MONEY + _MATCH + [
+    "Automation", "ZAPIER", "makexcom", "Contractor", "LPA", "permonth",
+    "verify", "OTP", "verified", "123456", "1234567", "Match", "schedule", "Interview", "hello", "x",
+]
+
+def test_infer_matches_keyword_lists_random():
+    rng = random.Random(2)
+    for _ in range(5000):
+        sep = rng.choice([" ", "", ",", "-"])
+        text = sep.join(rng.choice(_WORDS) for _ in range(rng.randint(0, 5)))
+        for prev in PREVS:
+            assert _infer(prev, text, {}) == (_old_intent(text, {}), _old_stage(prev, text)), (prev, text)
+
+# ---------- _load_prompt ----------
+
+def test_load_prompt_is_shared_per_combo():
+    a = _load_prompt("hiring", "collect")
+    assert a is _load_prompt("hiring", "collect")
+    assert "- Scope: hiring." in a and "# GOAL (collect)" in a
+    assert _load_prompt("staffing", "enrich") != a
@@ -0,0 +1,79 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import chat_router, gpt_router
+from routers.gpt_router import _reply_key, run_llm_turn
+
+SLOTS = {"role_title": "python engineer", "location": "Pune"}
+
+@pytest.fixture
+def model(monkeypatch):
+    """Fake model: counts calls, answers with a per-call text."""
+    calls = []
+    async def fake_chat(messages, user):
+        calls.append(messages)
+        return f"reply {len(calls)}"
+    monkeypatch.setattr(gpt_router, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(gpt_router, "_async_openai_chat", fake_chat)
+    gpt_router._REPLY_CACHE.clear()
+    return calls
+
+def _run(**kw):
+    args = {"cid": uuid.uuid4().hex, "user_text": "budget is 20 LPA", "entity_id": "e1",
+            "platform": "web", "thread_id": "t1", "user_id": "u1", "meta": {"slots": SLOTS}}
+    args.update(kw)
+    return asyncio.run(run_llm_turn(**args))
+
+# ---------- reply cache ----------
+
+def test_reply_key_is_scoped():
+    base = ("e1", "c1", "USER: hi", "# CURRENT STATE", SLOTS, "budget?")
+    key = _reply_key(*base)
+    assert key == _reply_key("e1", "c1", "USER: hi", "# CURRENT STATE", SLOTS, "  Budget? ")
+    assert key != _reply_key("e2", *base[1:])
+    assert key != _reply_key("e1", "c2", *base[2:])
+    assert key != _reply_key("e1", "c1", "USER: hello", *base[3:])
+
+def test_reply_key_skips_codes():
+    assert _reply_key("e1", "c1", "", "", {}, "my code is 123456") is None
+
+def test_resend_in_same_conversation_is_cached(model):
+    cid = uuid.uuid4().hex
+    assert _run(cid=cid)["text"] == "reply 1"
+    assert _run(cid=cid)["text"] == "reply 1"
+    assert len(model) == 1
+
+def test_reply_not_shared_across_conversations_or_entities(model):
+    _run(cid="c-shared", entity_id="e1")
+    _run(cid="c-shared", entity_id="e2")
+    _run(entity_id="e1")
+    assert len(model) == 3
+
+def test_fallback_without_key(monkeypatch):
+    monkeypatch.setattr(gpt_router, "OPENAI_API_KEY", None)
+    assert _run(fallback="deterministic")["text"] == "deterministic"
+
+# ---------- wired into /chat/turn ----------
+
+def _turn(text):
+    app = FastAPI()
+    app.include_router(chat_router.router)
+    headers = {"entity-id": "e", "platform": "web", "thread-id": uuid.uuid4().hex, "user-id": "u1"}
+    with TestClient(app) as c:
+        r = c.post("/chat/turn", json={"text": text}, headers=headers)
+        c.portal.call(chat_router.flush_ingest_queue)
+    assert r.status_code == 200
+    return r.json()
+
+def test_chat_turn_uses_llm_turn(model, monkeypatch):
+    monkeypatch.setattr(chat_router, "USE_LLM_TURN", True)
+    assert _turn("Need a python engineer in Pune")["text"] == "reply 1"
+    assert model[0][-1] == {"role": "user", "content": "Need a python engineer in Pune"}
+
+def test_chat_turn_off_by_default(model):
+    assert _turn("Need a python engineer in Pune")["text"] != "reply 1"
+    assert not model
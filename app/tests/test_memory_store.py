@@ -0,0 +1,151 @@
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.memory_store import (
+    conversation_version,
+    ingest_message,
+    ingest_messages,
+    ingest_messages_bulk,
+    latest_slots,
+    list_recent,
+    request_slots,
+)
+from routers.memory_router import router as memory_router
+
+def _cid():
+    return uuid.uuid4().hex
+
+# ---------- ingest_messages ----------
+
+def test_ingest_messages_returns_mids_in_order():
+    cid = _cid()
+    mids = ingest_messages(cid, [
+        {"role": "user", "text": "hi", "meta": {}},
+        {"role": "assistant", "text": "hello", "meta": {}},
+    ])
+    assert len(set(mids)) == 2
+    assert [r["mid"] for r in list_recent(cid)] == mids
+    assert [r["text"] for r in list_recent(cid)] == ["hi", "hello"]
+
+def test_ingest_messages_same_prefix_is_idempotent():
+    cid = _cid()
+    rows = [{"role": "user", "text": "a"}, {"role": "assistant", "text": "b"}]
+    first = ingest_messages(cid, rows, idem_prefix="turn-1")
+    version = conversation_version(cid)
+    assert ingest_messages(cid, rows, idem_prefix="turn-1") == first
+    assert conversation_version(cid) == version
+    assert len(list_recent(cid, limit=20)) == 2
+
+def test_ingest_messages_row_idem_wins_over_prefix():
+    cid = _cid()
+    mid = ingest_message(cid, "user", "a", {}, "k1")
+    mids = ingest_messages(cid, [{"role": "user", "text": "a", "idem": "k1"}, {"role": "user", "text": "b"}], idem_prefix="p")
+    assert mids[0] == mid
+    assert len(list_recent(cid, limit=20)) == 2
+
+def test_ingest_messages_without_prefix_never_collides():
+    cid = _cid()
+    rows = [{"role": "user", "text": "same"}]
+    assert ingest_messages(cid, rows) != ingest_messages(cid, rows)
+
+# ---------- ingest_messages_bulk ----------
+
+def test_ingest_messages_bulk_per_conversation():
+    a, b = _cid(), _cid()
+    out = ingest_messages_bulk([
+        (a, [{"role": "user", "text": "a1"}, {"role": "assistant", "text": "a2"}]),
+        (b, [{"role": "user", "text": "b1"}]),
+    ])
+    assert [len(m) for m in out] == [2, 1]
+    assert [r["mid"] for r in list_recent(a)] == out[0]
+    assert [r["mid"] for r in list_recent(b)] == out[1]
+    assert conversation_version(a) == 2 and conversation_version(b) == 1
+
+# ---------- latest_slots ----------
+
+def test_latest_slots_unknown_cid():
+    assert latest_slots(_cid()) is None
+
+def test_latest_slots_newest_row_with_slots():
+    cid = _cid()
+    ingest_messages(cid, [
+        {"role": "assistant", "text": "x", "meta": {"slots": {"location": "Pune"}}},
+        {"role": "assistant", "text": "y", "meta": {"slots": {"location": "Delhi"}}},
+        {"role": "user", "text": "no slots here", "meta": {}},
+    ])
+    assert latest_slots(cid) == {"location": "Delhi"}
+
+def test_latest_slots_filters_by_thread():
+    cid = _cid()
+    ingest_messages(cid, [
+        {"role": "assistant", "text": "x", "meta": {"thread_id": "t1", "slots": {"budget": "10"}}},
+        {"role": "assistant", "text": "y", "meta": {"thread_id": "t2", "slots": {"budget": "20"}}},
+    ])
+    assert latest_slots(cid, "t1") == {"budget": "10"}
+    assert latest_slots(cid, "t2") == {"budget": "20"}
+    assert latest_slots(cid, "t3") is None
+
+def test_latest_slots_row_without_thread_counts_for_any_thread_only():
+    cid = _cid()
+    ingest_messages(cid, [
+        {"role": "user", "text": "x", "meta": {"thread_id": "t1", "slots": {"budget": "10"}}},
+        {"role": "assistant", "text": "y", "meta": {"slots": {"budget": "20"}}},
+    ])
+    assert latest_slots(cid) == {"budget": "20"}
+    assert latest_slots(cid, "t1") == {"budget": "10"}
+
+def test_latest_slots_duplicate_insert_keeps_newest():
+    cid = _cid()
+    ingest_message(cid, "user", "a", {"slots": {"budget": "10"}}, "k1")
+    ingest_message(cid, "user", "b", {"slots": {"budget": "20"}}, "k2")
+    ingest_message(cid, "user", "a", {"slots": {"budget": "10"}}, "k1")   # retry of an older row
+    assert latest_slots(cid) == {"budget": "20"}
+
+def test_request_slots_per_rid():
+    cid = _cid()
+    ingest_messages(cid, [
+        {"role": "user", "text": "x", "meta": {"rid": "r1", "slots": {"budget": "10"}}},
+        {"role": "user", "text": "y", "meta": {"rid": "r2", "slots": {"budget": "20"}}},
+    ])
+    assert request_slots(cid, "r1") == {"budget": "10"}
+    assert request_slots(cid, "r3") is None
+
+# ---------- POST /messages.ingest_batch ----------
+
+def _client():
+    app = FastAPI()
+    app.include_router(memory_router)
+    return TestClient(app)
+
+def _batch(thread_id, rows, user_id="u1"):
+    return {"entity_id": "e", "platform": "web", "thread_id": thread_id, "user_id": user_id, "rows": rows}
+
+def test_ingest_batch_retry_is_idempotent_without_header():
+    c, thread = _client(), _cid()
+    body = _batch(thread, [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}])
+    first = c.post("/messages.ingest_batch", json=body).json()
+    again = c.post("/messages.ingest_batch", json=body).json()
+    assert again["cid"] == first["cid"] and again["mids"] == first["mids"]
+    assert len(list_recent(first["cid"], limit=20)) == 2
+
+def test_ingest_batch_fallback_key_includes_user():
+    c, thread = _client(), _cid()
+    rows = [{"role": "user", "content": "hi"}]
+    a = c.post("/messages.ingest_batch", json=_batch(thread, rows, "u1")).json()
+    b = c.post("/messages.ingest_batch", json=_batch(thread, rows, "u2")).json()
+    assert a["cid"] == b["cid"] and a["mids"] != b["mids"]
+
+def test_ingest_batch_header_key():
+    c, thread = _client(), _cid()
+    body = _batch(thread, [{"role": "user", "content": "ok"}, {"role": "user", "content": "ok"}])
+    first = c.post("/messages.ingest_batch", json=body, headers={"Idempotency-Key": "turn-7"}).json()
+    assert len(set(first["mids"])) == 2   # same text twice in one turn is still two rows
+    again = c.post("/messages.ingest_batch", json=body, headers={"Idempotency-Key": "turn-7"}).json()
+    assert again["mids"] == first["mids"]
+
+def test_ingest_batch_rejects_bad_role():
+    c = _client()
+    r = c.post("/messages.ingest_batch", json=_batch(_cid(), [{"role": "bot", "content": "x"}]))
+    assert r.status_code == 400
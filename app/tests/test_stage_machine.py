@@ -6,6 +6,7 @@ from services.stage_machine import (
     missing_for_stage,
     next_stage,
     advance_until_stable,
+    compute_plan,
 )
 # ---------- missing_for_stage ----------
 
@@ -156,3 +157,19 @@ def test_advance_until_stable_invalid_stage_input():
     }
     # invalid start → behave as if starting at collect
     assert advance_until_stable("bogus", slots) == "match"
+
+# ---------- compute_plan (fused) ----------
+
+@pytest.mark.parametrize("stage", STAGES + ["bogus"])
+@pytest.mark.parametrize("slots", [
+    {},
+    {"role_title": "SRE"},
+    {"role_title": "QA", "location": "Pune", "budget": {"raw": "$25/hr"},
+     "seniority": "mid", "stack": ["python"], "employment_type": "contract"},
+    {"role_title": "QA", "location": "Pune", "budget": {"raw": "$25/hr"},
+     "seniority": "mid", "stack": ["python"], "candidates": ["c1"]},
+])
+def test_compute_plan_matches_separate_calls(stage, slots):
+    ask = next_stage(stage, slots)
+    assert compute_plan(stage, slots) == (ask, advance_until_stable(stage, slots), missing_for_stage(ask, slots))
+